@@ -1,28 +1,43 @@
 import argparse
 import os
 import re
-import csv
 #from datetime import datetime as dt
-from image import load_image, crop_image, scale_image, savez_compressed
+from PIL import Image
+from image import load_image, load_grey_crop, crop_and_scale, RESIZE_BACKENDS, AUTO_RESIZE_BACKEND, \
+    DEFAULT_RESIZE_BACKEND
 from camera_model import CameraModel
-from transform import build_se3_transform, build_intrinsic_matrix
-from array_utils import save_as_list, list_to_array, save_txt
+from transform import build_se3_transforms, build_intrinsic_matrix
+from array_utils import save_txt, NpyStreamWriter, savez_compressed_atomic
+from worker_pool import imap_ordered, get_context
+from timestamp_index import TimestampIndex
+from pose_log import PoseLog
 import numpy as np
 
 
-def process_image(img, crop=None, scale=None):
-    return resize_image(img, crop, scale)
+def process_image(img, crop=None, scale=None, out=None, backend=None):
+    return resize_image(img, crop, scale, out, backend)
 
 
-def resize_image(img, crop=None, scale=None):
+# Crop and scale are fused, writing into out if supplied. See image.crop_and_scale for the available backends
+def resize_image(img, crop=None, scale=None, out=None, backend=None):
     resolution = get_resolution(img)
-    if crop:
-        img = crop_image(img, crop[0], crop[1])
-    if scale:
-        img = scale_image(img, scale[0], scale[1])
+    img = crop_and_scale(img, crop, scale, out=out, backend=backend)
     return img, resolution
 
 
+# Loads a frame and crops and scales it.
+# With fused_grey the grey crop is computed straight from the Bayer mosaic (see image.load_grey_crop)
+# Output:
+#       img: cropped and scaled image (out if supplied)
+#       resolution: [width, height] of the original image
+def load_frame(image_filename, model=None, crop=None, scale=None, out=None, backend=None, fused_grey=False):
+    if fused_grey:
+        resolution = list(Image.open(image_filename).size)
+        img = crop_and_scale(load_grey_crop(image_filename, model, crop), None, scale, out=out, backend=backend)
+        return img, resolution
+    return process_image(load_image(image_filename, model), crop, scale, out=out, backend=backend)
+
+
 def get_resolution(img):
     resolution = [img.shape[1], img.shape[0]]
     return resolution
@@ -43,15 +58,14 @@ def main():
 
     camera = re.search('(stereo|mono_(left|right|rear))', args.dir).group(0)
 
-    timestamps_path = os.path.join(os.path.join(args.dir, os.pardir, camera + '.timestamps'))
-    if not os.path.isfile(timestamps_path):
-      timestamps_path = os.path.join(args.dir, os.pardir, os.pardir, camera + '.timestamps')
-      if not os.path.isfile(timestamps_path):
-          raise IOError("Could not find timestamps file")
+    # Fails early if the camera has no timestamps file
+    TimestampIndex.from_sensor_dir(args.dir, camera)
 
     model = None
     if args.models_dir:
         model = CameraModel(args.models_dir, args.dir)
+    if args.workers < 1:
+        raise ValueError('--workers must be at least 1')
 
     output_dir = os.curdir
     if args.output_dir:
@@ -59,65 +73,124 @@ def main():
     if not os.path.isdir(output_dir):
         raise IOError(output_dir + "is not an existing folder")
 
-    result_list = []
-    count = 0
-    dictionary = {}
-    t_records = []
-    p_records = []
-    angles_records = []
-    intrinsic_matrix = None
-
-    with open(args.poses_file) as vo_file:
-            vo_reader = csv.reader(vo_file)
-            headers = next(vo_file)
-            for row in vo_reader:
-                src_image_name = row[0]
-                dst_image_name = row[1]
-                src_image_filename = os.path.join(args.dir, src_image_name + '.png')
-                dst_image_filename = os.path.join(args.dir, dst_image_name + '.png')
-                if not os.path.isfile(src_image_filename) or not os.path.isfile(dst_image_filename):
-                    continue
-                if dst_image_name not in dictionary:
-                    img, orig_resolution = process_image(load_image(dst_image_filename, model), args.crop, args.scale)
-                    dictionary[dst_image_name] = count
-                    count = count + 1
-                    result_list.append(list(img))
-                if src_image_name not in dictionary:
-                    img, orig_resolution = process_image(load_image(src_image_filename, model), args.crop, args.scale)
-                    dictionary[src_image_name] = count
-                    count = count + 1
-                    result_list.append(list(img))
-
-                focal_length, principal_point = get_intrinsics_parameters(model.get_focal_length(), model.get_principal_point(), orig_resolution, args.crop, args.scale)
-                src_image_idx = dictionary[src_image_name]
-                dst_image_idx = dictionary[dst_image_name]
-                xyzrpy = [float(v) for v in row[2:8]]
-                rel_pose = build_se3_transform(xyzrpy)
-                t_matrix = rel_pose[0:3] # 3x4 matrix
-                intrinsic_matrix = build_intrinsic_matrix(focal_length, principal_point)
-                p_matrix = intrinsic_matrix * t_matrix
-                t_records.append((t_matrix, src_image_idx, dst_image_idx))
-                p_records.append((p_matrix, src_image_idx, dst_image_idx))
-                angles_records.append((xyzrpy, src_image_idx, dst_image_idx))
-
-    transf = np.array(t_records, dtype=[('T',('float64',(3,4))),('src_idx', 'int32'),('dst_idx', 'int32')])
-    proy = np.array(p_records, dtype=[('P',('float64',(3,4))),('src_idx', 'int32'),('dst_idx', 'int32')])
-    angles = np.array(angles_records, dtype=[('ang',('float64',6)),('src_idx', 'int32'),('dst_idx', 'int32')])
+    # First pass: frame indices and relative poses
+    frame_names, xyzrpys, src_idx, dst_idx = scan_poses_file(args.poses_file, args.dir)
+
+    # Second pass: frames are demosaiced, undistorted and resized by the workers straight into a preallocated
+    # array on disk. The first frame is processed here to find the output shape
+    if not frame_names:
+        raise ValueError('No frames found in ' + args.poses_file)
+    images_path = os.path.join(output_dir, 'images.npy')
+    with NpyStreamWriter(os.path.join(output_dir, 'images'), len(frame_names), np.uint8,
+                         flush_every=args.flush_every) as images_writer:
+        img, orig_resolution = load_frame(os.path.join(args.dir, frame_names[0] + '.png'), model, args.crop,
+                                          args.scale, backend=args.resize_backend, fused_grey=args.fused_grey)
+        images_writer.write(0, img)
+        images_writer.flush()
+        context = {'images_path': images_writer.tmp_path, 'models_dir': args.models_dir, 'images_dir': args.dir,
+                   'crop': args.crop, 'scale': args.scale, 'resize_backend': args.resize_backend,
+                   'fused_grey': args.fused_grey}
+        if args.workers <= 1:
+            context['model'] = model
+        jobs = [(idx, os.path.join(args.dir, image_name + '.png')) for idx, image_name in enumerate(frame_names)][1:]
+        for idx, _ in imap_ordered(process_frame, jobs, context, args.workers):
+            if idx % 1000 == 0:
+                print('%i/%i' % (idx, len(frame_names)))
+        # Serially, the frames were written through the worker context of this process
+        _close_context(get_context())
+
+    rel_poses = build_se3_transforms(xyzrpys)
+    t_matrices = rel_poses[:, 0:3, :]  # 3x4 matrices
+    transf = _build_records(t_matrices, src_idx, dst_idx, ('T', ('float64', (3, 4))))
+    angles = _build_records(xyzrpys, src_idx, dst_idx, ('ang', ('float64', 6)))
     # Solo lo guardo una vez porque es constante para todo el dataset (o deberia serlo)
-    if intrinsic_matrix is not None:
+    if model is not None and orig_resolution is not None:
+        focal_length, principal_point = get_intrinsics_parameters(model.get_focal_length(), model.get_principal_point(), orig_resolution, args.crop, args.scale)
+        intrinsic_matrix = build_intrinsic_matrix(focal_length, principal_point)
+        p_matrices = np.matmul(np.asarray(intrinsic_matrix), t_matrices)
+        proy = _build_records(p_matrices, src_idx, dst_idx, ('P', ('float64', (3, 4))))
         save_txt(os.path.join(output_dir,"intrinsic_matrix"), intrinsic_matrix)
         save_txt(os.path.join(output_dir,"intrinsic_parameters"), [focal_length, principal_point])
+        savez_compressed_atomic(os.path.join(output_dir, 'p'), proy)
     #path = os.path.normpath(args.dir)
     #folders = path.split(os.sep)
     #compressed_file_path = os.path.join(output_dir, folders[-3])
-    result = list_to_array(result_list)
+    result = np.load(images_path, mmap_mode='r')
     save_txt(os.path.join(output_dir, 'images_shape'), result.shape, fmt='%i')
-    print result.shape
+    print(result.shape)
     compressed_file_path = os.path.join(output_dir, 'images')
-    savez_compressed(compressed_file_path, result)
-    savez_compressed(os.path.join(output_dir, 't'),transf)
-    savez_compressed(os.path.join(output_dir, 'p'),proy)
-    savez_compressed(os.path.join(output_dir, 'angles'),angles)
+    savez_compressed_atomic(compressed_file_path, result)
+    savez_compressed_atomic(os.path.join(output_dir, 't'), transf)
+    savez_compressed_atomic(os.path.join(output_dir, 'angles'), angles)
+
+
+# Loads, demosaics, undistorts and resizes one frame into the shared output array.
+# The output array and the camera model are opened once per worker and kept in its context.
+# Input:
+#       job: (frame index, image path)
+# Output:
+#       (frame index, original resolution)
+def process_frame(job):
+    idx, image_filename = job
+    context = get_context()
+    if 'images' not in context:
+        context['images'] = np.load(context['images_path'], mmap_mode='r+')
+    if 'model' not in context:
+        context['model'] = None
+        if context['models_dir']:
+            context['model'] = CameraModel(context['models_dir'], context['images_dir'])
+    _, orig_resolution = load_frame(image_filename, context['model'], context['crop'], context['scale'],
+                                    out=context['images'][idx], backend=context['resize_backend'],
+                                    fused_grey=context['fused_grey'])
+    return idx, orig_resolution
+
+
+# Flushes and releases the output array opened by process_frame in this process. The context is the one held by
+# worker_pool (see get_context), not the dict passed to imap_ordered, which is copied into it
+def _close_context(context):
+    images = context.pop('images', None)
+    if images is not None:
+        images.flush()
+        del images
+
+
+# Assigns an index to every frame referenced by the VO file, in the order they are first seen (dst before src).
+# Rows whose images are missing are skipped.
+# Output:
+#       frame_names: list of image names (timestamps), the position in the list is the frame index
+#       xyzrpys: Mx6 array of relative poses
+#       src_idx, dst_idx: arrays of M frame indices
+def scan_poses_file(poses_file, images_dir):
+    dictionary = {}
+    frame_names = []
+    rows = []
+    src_idx = []
+    dst_idx = []
+    vo = PoseLog(poses_file)
+    available = set(name[:-len('.png')] for name in os.listdir(images_dir) if name.endswith('.png'))
+    for row, (src_timestamp, dst_timestamp) in enumerate(zip(vo.timestamps.tolist(),
+                                                              vo.destination_timestamps.tolist())):
+        src_image_name = str(src_timestamp)
+        dst_image_name = str(dst_timestamp)
+        if src_image_name not in available or dst_image_name not in available:
+            continue
+        for image_name in (dst_image_name, src_image_name):
+            if image_name not in dictionary:
+                dictionary[image_name] = len(frame_names)
+                frame_names.append(image_name)
+        src_idx.append(dictionary[src_image_name])
+        dst_idx.append(dictionary[dst_image_name])
+        rows.append(row)
+    xyzrpys = np.array(vo.xyzrpys[rows], dtype=np.float64).reshape((-1, 6))
+    return frame_names, xyzrpys, np.array(src_idx, dtype=np.int32), np.array(dst_idx, dtype=np.int32)
+
+
+def _build_records(values, src_idx, dst_idx, value_field):
+    records = np.empty(len(src_idx), dtype=[value_field, ('src_idx', 'int32'), ('dst_idx', 'int32')])
+    records[value_field[0]] = values
+    records['src_idx'] = src_idx
+    records['dst_idx'] = dst_idx
+    return records
 
 
 def get_arguments():
@@ -131,6 +204,18 @@ def get_arguments():
     parser.add_argument('--scale', nargs=2, default=None, type=int, metavar=('WIDTH', 'HEIGHT'),
                         help='(optional) If supplied, images will be scaled to WIDTH x HEIGHT')
     parser.add_argument('--output_dir', type=str, default=None, help='(optional) Output directory')
+    parser.add_argument('--fused_grey', action='store_true',
+                        help='(optional) Compute the grey image straight from the Bayer mosaic and undistort only the '
+                             'crop, instead of demosaicing and undistorting the whole RGB image. Pixels are rounded '
+                             'instead of truncated, so they may differ by one grey level')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='(optional) Number of worker processes that demosaic, undistort and resize the images')
+    parser.add_argument('--flush_every', type=int, default=256,
+                        help='(optional) Flush the output array to disk every n frames')
+    parser.add_argument('--resize_backend', type=str, default=DEFAULT_RESIZE_BACKEND,
+                        choices=list(RESIZE_BACKENDS) + [AUTO_RESIZE_BACKEND],
+                        help='(optional) Resize backend. Defaults to pil, the same interpolation as scipy.misc.imresize. '
+                             'Run image.py to compare them')
     # parser.add_argument('image_name', type=str, help='Image name.')
     args = parser.parse_args()
     return args
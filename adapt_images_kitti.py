@@ -2,20 +2,18 @@ import adapt_images
 import os
 import argparse
 import numpy as np
-from image import non_demosaic_load, savez_compressed
-from transform import build_intrinsic_matrix
+from image import non_demosaic_load, load_reduced, RESIZE_BACKENDS, AUTO_RESIZE_BACKEND, DEFAULT_RESIZE_BACKEND
+from transform import build_intrinsic_matrix, se3_to_homogeneous, invert_se3_transforms, se3_to_xyzquaternion
 import matplotlib.pyplot as plt
-from array_utils import list_to_array, save_txt, save_npy
-from triangulate import triangulatePoints, matcher
-from outliers import mask_outliers
+from array_utils import save_txt, NpyStreamWriter, savez_compressed_atomic
+from frame_cache import FrameCache
+from worker_pool import imap_ordered, get_context
+from frame_source import PrefetchingFrameSource, play
+from triangulate_kitti import compute_points, list_image_paths, load_calibration
+from triangulate import MATCHERS, DEFAULT_MATCHER
 # from transformations import euler_from_matrix, translation_from_matrix
 
 
-_CAM2INDEX = {'cam0': 0, 'cam1': 1, 'cam2': 2, 'cam3': 3}
-_CAM2FOLDER = {'cam0': 'image_0', 'cam1': 'image_1', 'cam2': 'image_2', 'cam3': 'image_3'}
-DEFAULT_CALIBRATION_FILENAME = 'calib.txt'
-
-
 def get_arguments():
     parser = argparse.ArgumentParser(description='Play back images from a given directory')
     parser.add_argument('dir', type=str, help='Directory containing iamge sequence')
@@ -28,9 +26,29 @@ def get_arguments():
     parser.add_argument('--scale', nargs=2, default=None, type=int, metavar=('WIDTH', 'HEIGHT'),
                         help='(optional) If supplied, images will be scaled to WIDTH x HEIGHT')
     parser.add_argument('--output_dir', type=str, default=None, help='(optional) Output directory')
+    parser.add_argument('--resize_backend', type=str, default=DEFAULT_RESIZE_BACKEND,
+                        choices=list(RESIZE_BACKENDS) + [AUTO_RESIZE_BACKEND],
+                        help='(optional) Resize backend. Defaults to pil, the same interpolation as scipy.misc.imresize. '
+                             'Run image.py to compare them')
+    parser.add_argument('--reduced_decode', action='store_true',
+                        help='Decode the images at a reduced resolution when --crop and --scale allow it. Faster, '
+                             'but pixels may differ slightly. Run image.py --reduced to compare')
     parser.add_argument('--mirror', action='store_true', help='Flip the images (axis x)')
     parser.add_argument('--offset', type=int, default=1, help='Take pair of frames every n frames')
     parser.add_argument('--reverse', action='store_true', help='Reverse')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='(optional) Number of processes used to process the frames')
+    parser.add_argument('--flush_every', type=int, default=256,
+                        help='(optional) Flush the output arrays to disk every n frames')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='(optional) Directory of the frame cache. Runs with the same sources and crop, scale and '
+                             'mirror options reuse the cached frames instead of decoding the images again')
+    parser.add_argument('--points', action='store_true',
+                        help='Also triangulate points of the stereo pairs (points.npy). See triangulate_kitti')
+    parser.add_argument('--matcher', type=str, default=DEFAULT_MATCHER, choices=sorted(MATCHERS),
+                        help='(optional) Stereo matcher used with --points')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='(optional) Base seed. Frame i uses seed + i to select its triangulated points')
     # parser.add_argument('image_name', type=str, help='Image name.')
     args = parser.parse_args()
     return args
@@ -58,23 +76,20 @@ def get_intrinsics_parameters(focal_length, principal_point, resolution, crop=No
     return focal_length, principal_point
 
 
-def show(images):
+# Plays back a stack of images (e.g. memory-mapped), reading them ahead on background threads
+# Input:
+#       images: NxHxW array
+#       fps: (optional) target rate, frames are dropped when playback falls behind it
+def show(images, fps=None, workers=2):
     artist = plt.imshow(images[0], cmap='gray')
-    for img in images:
-        artist.set_data(img)
-        plt.xticks([])
-        plt.yticks([])
-        plt.pause(0.01)
-
+    plt.xticks([])
+    plt.yticks([])
 
-def get_calibration_matrix(calibration, cam):
-    idx = _CAM2INDEX[cam]
-    calibration_matrix = calibration[idx, 1:]
-    return np.asmatrix(calibration_matrix.reshape(3, 4))
+    def display(frame):
+        artist.set_data(frame[1])
+        plt.pause(0.001)
 
-
-def get_image_folder_name(cam):
-    return _CAM2FOLDER[cam]
+    return play(PrefetchingFrameSource(range(len(images)), lambda idx: np.array(images[idx]), workers), display, fps)
 
 
 def calculate_transformation(pose_a, pose_b):
@@ -89,6 +104,48 @@ def get_src_dst_index(idx_pose, offset=1, reverse=None):
     return src_index, dst_index
 
 
+# Relative transformations between every pair of poses (src, dst), computed for all pairs at once
+# Input:
+#       poses: Nx12 array of absolute poses (KITTI format)
+# Output:
+#       transformations: Mx4x4 array, inv(poses[src_idx]) * poses[dst_idx] (M = N - offset)
+#       src_idx, dst_idx: arrays of M indices
+def calculate_transformations(poses, offset=1, reverse=False, mirror=False):
+    idx_pose = np.arange(poses.shape[0] - offset)
+    src_idx, dst_idx = get_src_dst_index(idx_pose, offset, reverse)
+    homogeneous_poses = se3_to_homogeneous(poses)
+    transformations = np.matmul(invert_se3_transforms(homogeneous_poses[src_idx]), homogeneous_poses[dst_idx])
+    if mirror:
+        # mirror * R * mirror with mirror = diag(-1, 1, 1) (in this case mirror = mirror^(-1))
+        signs = np.array([-1., 1., 1.])
+        transformations[:, 0:3, 0:3] *= signs[:, np.newaxis] * signs[np.newaxis, :]
+    return transformations, src_idx, dst_idx
+
+
+# Load an image and resize it
+# Input:
+#       job: (frame index, image path)
+# Output:
+#       (frame index, processed image, original resolution (None if the image was decoded at reduced resolution))
+def process_frame(job):
+    frame_idx, img_path = job
+    context = get_context()
+    if context['reduced_decode']:
+        modified_img = load_reduced(img_path, context['crop'], context['scale'], backend=context['resize_backend'])
+        original_resolution = None
+    else:
+        img = non_demosaic_load(img_path)
+        original_resolution = adapt_images.get_resolution(img)
+        assert isinstance(img, np.ndarray) and img.dtype == np.uint8 and img.flags.contiguous
+        modified_img, _ = adapt_images.process_image(img, crop=context['crop'], scale=context['scale'],
+                                                     backend=context['resize_backend'])
+    if context['mirror']:
+        modified_img = np.fliplr(modified_img)
+    assert isinstance(modified_img,
+                      np.ndarray) and modified_img.dtype == np.uint8  # and modified_img.flags.contiguous
+    return frame_idx, modified_img, original_resolution
+
+
 def main():
     args = get_arguments()
     is_mirror = args.mirror
@@ -101,55 +158,48 @@ def main():
     if not os.path.isdir(output_dir):
         raise IOError(output_dir + "is not an existing folder")
 
-    calib_file = os.path.join(args.dir, DEFAULT_CALIBRATION_FILENAME)
-    with open(calib_file) as calibration_file, open(args.poses_file) as poses_file:
-        calib = np.genfromtxt(calibration_file, delimiter=' ')
-        left_calibration_matrix = get_calibration_matrix(calib, "cam0")
-        right_calibration_matrix = get_calibration_matrix(calib, "cam1")
+    left_calibration_matrix, _ = load_calibration(args.dir)
+    with open(args.poses_file) as poses_file:
         poses = np.loadtxt(poses_file, delimiter=' ')
 
     # Left images
-    left_image_folder_name = get_image_folder_name("cam0")
-    left_image_dir = os.path.join(args.dir, left_image_folder_name)
-    left_image_filenames = sorted(
-        [item for item in os.listdir(left_image_dir) if os.path.isfile(os.path.join(left_image_dir, item))])
-
-    # Right images
-    right_image_folder_name = get_image_folder_name("cam1")
-    right_image_dir = os.path.join(args.dir, right_image_folder_name)
-    right_image_filenames = sorted(
-        [item for item in os.listdir(right_image_dir) if os.path.isfile(os.path.join(right_image_dir, item))])
+    left_image_paths = list_image_paths(args.dir, "cam0")
 
-    images_list = []
     crop = args.crop
     scale = args.scale
-    N = 25
-    cloud_points = np.empty((len(left_image_filenames), 3, N))
 
-    for (i, (left_img_name, right_img_name)) in enumerate(zip(left_image_filenames, right_image_filenames)):
-        left_img = non_demosaic_load(os.path.join(left_image_dir, left_img_name))
-        right_img = non_demosaic_load(os.path.join(right_image_dir, right_img_name))
-        assert left_img_name == right_img_name
+    jobs = list(enumerate(left_image_paths))
+    context = {'crop': crop,
+               'scale': scale,
+               'mirror': is_mirror,
+               'resize_backend': args.resize_backend,
+               'reduced_decode': args.reduced_decode}
+    images_path = os.path.join(output_dir, 'images.npy')
+    cache = None
+    if args.cache_dir:
+        cache = FrameCache(args.cache_dir)
+        frames_key = cache.key('frames', left_image_paths, crop=crop, scale=scale, mirror=is_mirror,
+                               resize_backend=args.resize_backend, reduced_decode=args.reduced_decode)
+
+    if cache is not None and cache.fetch(frames_key, images_path):
+        print("Frames loaded from cache")
+    else:
+        # Frames are written to disk as they are produced, so memory usage does not depend on the sequence length
+        with NpyStreamWriter(os.path.join(output_dir, 'images'), len(jobs), np.uint8,
+                             flush_every=args.flush_every) as images_writer:
+            for (i, modified_img, original_resolution) in imap_ordered(process_frame, jobs, context, args.workers):
+                images_writer.write(i, modified_img)
+        print(original_resolution)
+        if cache is not None:
+            cache.store(frames_key, images_path)
+    images_shape = np.load(images_path, mmap_mode='r').shape
+    print(images_shape)
+
+    # Triangulation is by far the most expensive step and only some models use the points
+    if args.points:
+        compute_points(args.dir, output_dir, seed=args.seed, matcher_name=args.matcher, workers=args.workers,
+                       cache_dir=args.cache_dir, flush_every=args.flush_every)
 
-        # X.shape -> 3xN
-        X = triangulate(left_img, right_img, left_calibration_matrix, right_calibration_matrix, N)
-        cloud_points[i] = X
-
-        original_resolution = adapt_images.get_resolution(left_img)
-        assert isinstance(left_img, np.ndarray) and left_img.dtype == np.uint8 and left_img.flags.contiguous
-        modified_img, _ = adapt_images.process_image(left_img, crop=crop, scale=scale)
-        if is_mirror:
-            modified_img = np.fliplr(modified_img)
-        assert isinstance(modified_img,
-                          np.ndarray) and modified_img.dtype == np.uint8  # and modified_img.flags.contiguous
-        images_list.append(modified_img)
-    save_npy(os.path.join(output_dir, 'points'), cloud_points)
-    print(original_resolution)
-    compressed_images = list_to_array(images_list)
-    print compressed_images.shape
-
-    t_records = []
-    # p_records = []
     offset = args.offset
     reverse = args.reverse
 
@@ -158,110 +208,28 @@ def main():
     #    [left_calibration_matrix[0, 0], left_calibration_matrix[1, 1]], [left_calibration_matrix[0, 2], left_calibration_matrix[1, 2]],
     #    original_resolution, crop=crop, scale=scale)
     # new_intrinsic_matrix = build_intrinsic_matrix(new_focal_length, new_principal_point)
-    assert len(left_image_filenames) == len(poses)
-    mirror = np.asmatrix(np.diag((-1, 1, 1)))
-    # In this case mirror = mirror^(-1)
-    mirror_inverse = mirror
-    transformations = []
-    for idx_pose in xrange(poses.shape[0] - offset):
-        # dst_index = idx_pose
-        # src_index = idx_pose + offset
-        src_index, dst_index = get_src_dst_index(idx_pose, offset, reverse)
-        src_pose = poses[src_index]
-        dst_pose = poses[dst_index]
-        src = vector_to_homogeneous(src_pose)
-        dst = vector_to_homogeneous(dst_pose)
-        transf_src_dst = calculate_transformation(src, dst)
-        if is_mirror:
-            transf_src_dst[0:3, 0:3] = mirror_inverse * transf_src_dst[0:3, 0:3] * mirror
-        t_matrix = transf_src_dst[0:3, :]
-        # FIXME no hay que solo premultiplicarlo por la intrinsic_matrix, el calculo es otro, ver la documentacion en el Drive
-        # p_matrix = new_intrinsic_matrix * t_matrix
-        t_records.append((t_matrix, src_index, dst_index))
-        # p_records.append((p_matrix, src_index, dst_index))
-        transformations.append(np.asarray(t_matrix).reshape(-1))
-
-    transf = np.array(t_records, dtype=[('T', ('float32', (3, 4))), ('src_idx', 'int32'), ('dst_idx', 'int32')])
-    # proy = np.array(p_records, dtype=[('P', ('float32', (3, 4))), ('src_idx', 'int32'), ('dst_idx', 'int32')])
-    savez_compressed(os.path.join(output_dir, 't'), transf)
+    assert len(left_image_paths) == len(poses)
+    transformations, src_idx, dst_idx = calculate_transformations(poses, offset, reverse, is_mirror)
+    # FIXME no hay que solo premultiplicarlo por la intrinsic_matrix, el calculo es otro, ver la documentacion en el Drive
+    # p_matrix = new_intrinsic_matrix * t_matrix
+    transf = np.empty(len(transformations),
+                      dtype=[('T', ('float32', (3, 4))), ('src_idx', 'int32'), ('dst_idx', 'int32')])
+    transf['T'] = transformations[:, 0:3, :]
+    transf['src_idx'] = src_idx
+    transf['dst_idx'] = dst_idx
+    # Labels (x, y, z, qw, qx, qy, qz) used by vgg_trainable/input_data.py, computed from the stored float32 matrices
+    labels = se3_to_xyzquaternion(transf['T']).astype(np.float32)
+    savez_compressed_atomic(os.path.join(output_dir, 't'), transf)
+    savez_compressed_atomic(os.path.join(output_dir, 'labels'), labels)
     # savez_compressed(os.path.join(output_dir, 'p'), proy)
     # save(os.path.join(output_dir, "intrinsic_matrix"), new_intrinsic_matrix, fmt='%.18e')
     # save(os.path.join(output_dir, "intrinsic_parameters"), [new_focal_length, new_principal_point], fmt='%.18e')
-    save_txt(os.path.join(output_dir, 'images_shape'), compressed_images.shape, fmt='%i')
+    save_txt(os.path.join(output_dir, 'images_shape'), images_shape, fmt='%i')
+    # images.npz is compressed from the memory-mapped images.npy, without loading the whole sequence
     compressed_images_path = os.path.join(output_dir, 'images')
-    savez_compressed(compressed_images_path, compressed_images)
-    ts = list_to_array(transformations)
-    # print(euler_from_matrix(transf_src_dst))
-    # print(translation_from_matrix(transf_src_dst))
+    savez_compressed_atomic(compressed_images_path, np.load(images_path, mmap_mode='r'))
+    ts = transformations[:, 0:3, :].reshape((-1, 12))
     save_txt(os.path.join(output_dir, 'transformations'), ts, fmt='%.18e')
 
-# Mask points near the center of the image
-# Input:
-#       x1 -> 3xN array of 2D coordinates (image plane coordinates)
-# Output:
-#       center_crop_mask -> 1D array of N bool values (shape = (N,))
-# FIXME it should depend on global crop args instead of calculate min and max
-def center_crop_mask(x1, tol=[150., 120.]):
-    center_crop_mask = np.ones(x1.shape[1], dtype=bool)
-    for i in range(2):
-        min = x1[i].min()
-        max = x1[i].max()
-        rang = (max - min) / 2
-        med_value = min + rang
-        mask = np.abs(x1[i] - med_value) < tol[i]
-        mask = np.squeeze(np.array(mask))
-        center_crop_mask &= mask
-
-    return center_crop_mask
-
-
-def in_front_of_cam_mask(X, focal_length):
-    mask = X[2] > focal_length
-    return mask
-
-# Triangulate points
-# Input:
-#       left_img: image
-#       right_img: image
-#       P1: projection matrix 3x4 (left)
-#       P2: projection matrix 3x4 (right)
-#       N: select N points
-# Output:
-#       X: array of 3D points (3xN)
-def triangulate(left_img, right_img, P1, P2, N):
-    pts_l, pts_r = matcher(left_img, right_img)
-
-    # X's points are in camera coordinates when P1 = left_calibration_matrix, i.e. the intrinsic parameters
-    X = triangulatePoints(P1, P2, pts_l, pts_r)
-    dim = X.shape[0]
-    # X.shape -> (4xN)
-    for i in range(3):
-        # Each axis (X,Y,Z) is filtered by mask_outliers
-        mask = mask_outliers(X[i], 1000)
-        X = X[:, mask]
-        X = X.reshape((dim, -1))
-
-    x1 = np.matmul(P1, X)
-    x1 /= x1[2]
-
-    # Mask points near the center
-    c_mask = center_crop_mask(x1)
-    X = X[:, c_mask]
-
-    # Mask points that are in front of the camera
-    # FIXME we need the real focal length in camera coordinate units (not pixel!)
-    # But for now, we just chech that Z is positive
-    front_mask = in_front_of_cam_mask(X, 0.)
-    X = X[:, front_mask]
-
-    # Randomly select N points
-    replace = X.shape[1] <= N
-    if replace:
-        print(X.shape[1])
-    random_selection = np.random.choice(X.shape[1], N, replace=replace)
-    X = X[:3, random_selection]
-    return X
-
-
 if __name__ == "__main__":
     main()
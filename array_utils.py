@@ -2,7 +2,10 @@
 # To change this template file, choose Tools | Templates
 # and open the template in the editor.
 
+import os
+import tempfile
 import numpy as np
+from numpy.lib.format import open_memmap
 
 def save_txt(name, array, fmt='%1.6f'):
     np.savetxt(name + '.txt', array, delimiter=' ', fmt=fmt)
@@ -20,4 +23,95 @@ def save_npy(name, arr):
     np.save(name, arr)
 
 def load_npy(name):
-    return np.load(name)
\ No newline at end of file
+    return np.load(name)
+
+def savez_compressed_atomic(name, array):
+    tmp_path = name + '.tmp.npz'
+    np.savez_compressed(tmp_path, array)
+    os.rename(tmp_path, name + '.npz')
+
+
+def load_cached_npy(cache_path, source_path, build, mmap_mode='r'):
+    """Loads an array cached in a .npy file, building and caching it first if it is missing or older than its source.
+
+    The array is written to a unique temporary file next to the cache, memory-mapped and then renamed into place, so
+    concurrent builders never write into a file that another one has published or mapped. Only complete files are
+    mapped: an existing cache, or the file this call wrote. If the cache cannot be written, the array built by `build`
+    is returned in memory.
+    """
+    if os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(source_path):
+        return np.load(cache_path, mmap_mode=mmap_mode)
+
+    array = build()
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp.npy', dir=os.path.dirname(os.path.abspath(cache_path)))
+    except (IOError, OSError):
+        return array
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            np.save(tmp_file, array)
+        os.chmod(tmp_path, 0o644)
+        cached = np.load(tmp_path, mmap_mode=mmap_mode)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        return array
+    return cached
+
+
+class NpyStreamWriter(object):
+    """Writes equally shaped items one at a time into a preallocated .npy file.
+
+    Items are written into a memory-mapped temporary file, which is flushed every `flush_every` items and renamed
+    to `name + '.npy'` by `close`. The shape of the items is taken from the first one if it is not supplied.
+    """
+
+    def __init__(self, name, length, dtype, item_shape=None, flush_every=256):
+        self.path = name + '.npy'
+        self.tmp_path = name + '.tmp.npy'
+        self._length = length
+        self._dtype = np.dtype(dtype)
+        self._flush_every = flush_every
+        self._array = None
+        self._shape = None
+        self._pending = 0
+        if item_shape is not None:
+            self._allocate(item_shape)
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def _allocate(self, item_shape):
+        self._shape = (self._length,) + tuple(item_shape)
+        self._array = open_memmap(self.tmp_path, mode='w+', dtype=self._dtype, shape=self._shape)
+
+    def write(self, idx, item):
+        if self._array is None:
+            self._allocate(np.shape(item))
+        self._array[idx] = item
+        self._pending += 1
+        if self._pending >= self._flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._array is not None:
+            self._array.flush()
+        self._pending = 0
+
+    def close(self):
+        if self._array is None:
+            raise ValueError('Nothing was written to ' + self.path)
+        self.flush()
+        self._array = None
+        os.rename(self.tmp_path, self.path)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # On error the flushed temporary file is left on disk
+        if exc_type is None:
+            self.close()
@@ -14,22 +14,35 @@
 
 import os
 import re
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from transform import build_se3_transform
+from timestamp_index import TimestampIndex
+from scan_store import ScanStore
 
-from interpolate_poses import interpolate_vo_poses, interpolate_ins_poses
+from interpolate_poses import interpolate_vo_poses, interpolate_ins_poses, PoseSource
 
 
-def build_pointcloud(lidar_dir, poses_file, extrinsics_dir, start_time, end_time, origin_time=-1):
+DEFAULT_WORKERS = 4
+
+
+def build_pointcloud(lidar_dir, poses_file, extrinsics_dir, start_time, end_time, origin_time=-1,
+                     workers=DEFAULT_WORKERS, scan_store=None, voxel_size=None):
     """Builds a pointcloud by combining multiple LIDAR scans with odometry information.
 
     Args:
         lidar_dir (str): Directory containing LIDAR scans.
-        poses_file (str): Path to a file containing pose information. Can be VO or INS data.
+        poses_file (str or interpolate_poses.PoseSource): Path to a file containing pose information, or the poses
+            already loaded from it. Can be VO or INS data.
         extrinsics_dir (str): Directory containing extrinsic calibrations.
         start_time (int): UNIX timestamp of the start of the window over which to build the pointcloud.
         end_time (int): UNIX timestamp of the end of the window over which to build the pointcloud.
         origin_time (int): UNIX timestamp of origin frame. Pointcloud coordinates are relative to this frame.
+        workers (int): number of threads reading and transforming scans.
+        scan_store (str or scan_store.ScanStore): (optional) packed scans of lidar_dir (see `scan_store.pack_scans`).
+            If supplied, the window is read from it instead of from the scan files.
+        voxel_size (float): (optional) if supplied, the pointcloud is downsampled to one point per voxel of this size,
+            see `voxel_downsample`.
 
     Returns:
         numpy.ndarray: 3xn array of (x, y, z) coordinates of pointcloud
@@ -40,18 +53,164 @@ def build_pointcloud(lidar_dir, poses_file, extrinsics_dir, start_time, end_time
         IOError: if scan files are not found.
 
     """
+    lidar, timestamps, G_origin_laser, scan_sizes, read_scan = \
+        _load_window(lidar_dir, poses_file, extrinsics_dir, start_time, end_time, origin_time, scan_store)
+
+    # The output is sized once from the scan files or the packed index
+    offsets = np.concatenate(([0], np.cumsum(scan_sizes))).astype(np.int64)
+    if offsets[-1] == 0:
+        raise IOError("Could not find scan files for given time range in directory " + lidar_dir)
+
+    pointcloud = np.empty((4, offsets[-1]))
+    if lidar == 'ldmrs':
+        reflectance = None
+    else:
+        reflectance = np.empty(offsets[-1])
+
+    def transform_scan(i):
+        if scan_sizes[i] == 0:
+            return
+        scan, scan_reflectance = _transform_scan(lidar, G_origin_laser[i], read_scan(i))
+        pointcloud[:, offsets[i]:offsets[i + 1]] = scan
+        if reflectance is not None:
+            reflectance[offsets[i]:offsets[i + 1]] = scan_reflectance
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        pool.map(transform_scan, range(0, len(scan_sizes)))
+    finally:
+        pool.close()
+        pool.join()
+
+    if voxel_size:
+        pointcloud, reflectance = voxel_downsample(pointcloud, reflectance, voxel_size)
+
+    pointcloud = np.asmatrix(pointcloud)
+
+    return pointcloud, reflectance
+
+
+def voxel_downsample(pointcloud, reflectance, voxel_size):
+    """Replaces the points in each cell of a voxel grid by their centroid.
+
+    Points are hashed to a single integer key per voxel and reduced with `np.unique`.
+
+    Args:
+        pointcloud (numpy.ndarray): 3xn or 4xn (homogeneous) array of points.
+        reflectance (numpy.array): array of n reflectance values, or None.
+        voxel_size (float): edge length of the voxels, in the units of pointcloud.
+
+    Returns:
+        numpy.ndarray: 4xm array of homogeneous (x, y, z, 1) coordinates of the voxel centroids, ordered by voxel.
+        numpy.array: array of m mean reflectance values per voxel, or None if reflectance is None.
+
+    Raises:
+        ValueError: if voxel_size is not positive.
+
+    """
+    if voxel_size <= 0:
+        raise ValueError('Voxel size must be positive')
+    xyz = np.asarray(pointcloud)[0:3, :]
+    if xyz.shape[1] == 0:
+        return np.ones((4, 0)), reflectance
+
+    voxels = np.floor(xyz / voxel_size).astype(np.int64)
+    voxels -= voxels.min(axis=1, keepdims=True)
+    dims = voxels.max(axis=1) + 1
+    keys = (voxels[0, :] * dims[1] + voxels[1, :]) * dims[2] + voxels[2, :]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+
+    downsampled = np.ones((4, len(counts)))
+    for row in range(0, 3):
+        downsampled[row, :] = np.bincount(inverse, weights=xyz[row, :]) / counts
+    if reflectance is not None:
+        reflectance = np.bincount(inverse, weights=reflectance) / counts
+    return downsampled, reflectance
+
+
+def iter_scans(lidar_dir, poses_file, extrinsics_dir, start_time, end_time, origin_time=-1, scan_store=None):
+    """Transforms the LIDAR scans of a window one at a time, in time order.
+
+    Takes the same arguments as `build_pointcloud`, but only one scan is held in memory at a time, so windows of any
+    length can be processed. Scans whose files are missing are skipped.
+
+    Yields:
+        int: UNIX timestamp of the scan.
+        numpy.ndarray: 4xn array of homogeneous (x, y, z, 1) coordinates of the scan, relative to the origin frame.
+        numpy.array: array of n reflectance values or None if no reflectance values are recorded (LDMRS)
+
+    Raises:
+        ValueError: if specified window doesn't contain any laser scans.
+
+    """
+    lidar, timestamps, G_origin_laser, scan_sizes, read_scan = \
+        _load_window(lidar_dir, poses_file, extrinsics_dir, start_time, end_time, origin_time, scan_store)
+
+    for i in range(0, len(scan_sizes)):
+        if scan_sizes[i] == 0:
+            continue
+        scan, reflectance = _transform_scan(lidar, G_origin_laser[i], read_scan(i))
+        yield timestamps[i], scan, reflectance
+
+
+def iter_pointcloud_chunks(lidar_dir, poses_file, extrinsics_dir, start_time, end_time, origin_time=-1,
+                           scan_store=None, chunk_size=1000000):
+    """Builds the pointcloud of a window in chunks of a fixed number of points, in time order.
+
+    Takes the same arguments as `build_pointcloud`. Concatenating the chunks gives the output of `build_pointcloud`.
+
+    Args:
+        chunk_size (int): number of points per chunk. The last chunk may be smaller.
+
+    Yields:
+        numpy.ndarray: 4xn array of homogeneous (x, y, z, 1) coordinates, relative to the origin frame.
+        numpy.array: array of n reflectance values or None if no reflectance values are recorded (LDMRS)
+        numpy.array: int64 array of n timestamps, of the scan each point comes from.
+
+    """
+    pointcloud = reflectance = timestamps = None
+    filled = 0
+    for timestamp, scan, scan_reflectance in iter_scans(lidar_dir, poses_file, extrinsics_dir, start_time,
+                                                        end_time, origin_time, scan_store):
+        start = 0
+        while start < scan.shape[1]:
+            if pointcloud is None:
+                pointcloud = np.empty((4, chunk_size))
+                reflectance = np.empty(chunk_size) if scan_reflectance is not None else None
+                timestamps = np.empty(chunk_size, dtype=np.int64)
+                filled = 0
+            count = min(scan.shape[1] - start, chunk_size - filled)
+            pointcloud[:, filled:filled + count] = scan[:, start:start + count]
+            if reflectance is not None:
+                reflectance[filled:filled + count] = scan_reflectance[start:start + count]
+            timestamps[filled:filled + count] = timestamp
+            filled += count
+            start += count
+            if filled == chunk_size:
+                yield pointcloud, reflectance, timestamps
+                pointcloud = None
+
+    if pointcloud is not None and filled > 0:
+        yield pointcloud[:, :filled], reflectance[:filled] if reflectance is not None else None, timestamps[:filled]
+
+
+def _load_window(lidar_dir, poses_file, extrinsics_dir, start_time, end_time, origin_time, scan_store):
+    # Finds the scans of a window and their transforms to the origin frame.
+    # Returns the lidar name, the scan timestamps, the transforms, the number of points of each scan and a function
+    # that reads scan i as a 3xn array
     if origin_time < 0:
         origin_time = start_time
 
     lidar = re.search('(lms_front|lms_rear|ldmrs)', lidar_dir).group(0)
-    timestamps_path = os.path.join(lidar_dir, os.pardir, lidar + '.timestamps')
-
-    timestamps = []
-    with open(timestamps_path) as timestamps_file:
-        for line in timestamps_file:
-            timestamp = int(line.split(' ')[0])
-            if start_time <= timestamp <= end_time:
-                timestamps.append(timestamp)
+    if scan_store is None:
+        timestamps = TimestampIndex(os.path.join(lidar_dir, os.pardir, lidar + '.timestamps'))
+        timestamps = timestamps.window(start_time, end_time).tolist()
+    else:
+        if not isinstance(scan_store, ScanStore):
+            scan_store = ScanStore(scan_store)
+        entries, points = scan_store.window(start_time, end_time)
+        timestamps = entries['timestamp'].tolist()
 
     if len(timestamps) == 0:
         raise ValueError("No LIDAR data in the given time bracket.")
@@ -60,7 +219,10 @@ def build_pointcloud(lidar_dir, poses_file, extrinsics_dir, start_time, end_time
         extrinsics = next(extrinsics_file)
     G_posesource_laser = build_se3_transform([float(x) for x in extrinsics.split(' ')])
 
-    poses_type = re.search('(vo|ins)\.csv', poses_file).group(1)
+    if isinstance(poses_file, PoseSource):
+        poses_type = poses_file.type
+    else:
+        poses_type = re.search('(vo|ins)\.csv', poses_file).group(1)
 
     if poses_type == 'ins':
         with open(os.path.join(extrinsics_dir, 'ins.txt')) as extrinsics_file:
@@ -68,41 +230,45 @@ def build_pointcloud(lidar_dir, poses_file, extrinsics_dir, start_time, end_time
             G_posesource_laser = np.linalg.solve(build_se3_transform([float(x) for x in extrinsics.split(' ')]),
                                                  G_posesource_laser)
 
+    if isinstance(poses_file, PoseSource):
+        poses = poses_file.interpolate(timestamps, origin_time)
+    elif poses_type == 'ins':
         poses = interpolate_ins_poses(poses_file, timestamps, origin_time)
     else:
         # sensor is VO, which is located at the main vehicle frame
         poses = interpolate_vo_poses(poses_file, timestamps, origin_time)
 
-    pointcloud = np.array([[0], [0], [0], [0]])
-    if lidar == 'ldmrs':
-        reflectance = None
-    else:
-        reflectance = np.empty((0))
-
-    for i in range(0, len(poses)):
-        scan_path = os.path.join(lidar_dir, str(timestamps[i]) + '.bin')
-        if not os.path.isfile(scan_path):
-            continue
+    # Transforms from the laser to the origin frame, one per scan
+    G_origin_laser = np.matmul(np.asarray(poses), np.asarray(G_posesource_laser))
 
-        scan_file = open(scan_path)
-        scan = np.fromfile(scan_file, np.double)
-        scan_file.close()
+    # LIDAR scans are tuples of 3 doubles
+    if scan_store is None:
+        scan_paths = [os.path.join(lidar_dir, str(timestamps[i]) + '.bin') for i in range(0, len(poses))]
+        scan_sizes = [os.path.getsize(path) // (3 * 8) if os.path.isfile(path) else 0 for path in scan_paths]
 
-        scan = scan.reshape((len(scan) // 3, 3)).transpose()
+        def read_scan(i):
+            scan = np.fromfile(scan_paths[i], np.double)
+            return scan.reshape((len(scan) // 3, 3)).transpose()
+    else:
+        scan_sizes = entries['count'][0:len(poses)].tolist()
+        scan_offsets = (entries['offset'] - entries['offset'][0]).tolist()
 
-        if lidar != 'ldmrs':
-            # LMS scans are tuples of (x, y, reflectance)
-            reflectance = np.concatenate((reflectance, np.ravel(scan[2, :])))
-            scan[2, :] = np.zeros((1, scan.shape[1]))
+        def read_scan(i):
+            # Read-only view of the memory-mapped store
+            return points[scan_offsets[i]:scan_offsets[i] + scan_sizes[i]].transpose()
 
-        scan = np.dot(np.dot(poses[i], G_posesource_laser), np.vstack([scan, np.ones((1, scan.shape[1]))]))
-        pointcloud = np.hstack([pointcloud, scan])
+    return lidar, timestamps, G_origin_laser, scan_sizes, read_scan
 
-    pointcloud = pointcloud[:, 1:]
-    if pointcloud.shape[1] == 0:
-        raise IOError("Could not find scan files for given time range in directory " + lidar_dir)
 
-    return pointcloud, reflectance
+def _transform_scan(lidar, G_origin_laser, scan):
+    # Transforms a 3xn scan to the origin frame, returns the 4xn homogeneous points and the reflectance (None for LDMRS)
+    scan = np.vstack([scan, np.ones((1, scan.shape[1]))])
+    reflectance = None
+    if lidar != 'ldmrs':
+        # LMS scans are tuples of (x, y, reflectance)
+        reflectance = scan[2, :].copy()
+        scan[2, :] = np.zeros((1, scan.shape[1]))
+    return np.dot(G_origin_laser, scan), reflectance
 
 
 if __name__ == "__main__":
@@ -115,18 +281,23 @@ if __name__ == "__main__":
     parser.add_argument('--extrinsics_dir', type=str, default=None,
                         help='Directory containing extrinsic calibrations')
     parser.add_argument('--laser_dir', type=str, default=None, help='Directory containing LIDAR data')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='(optional) Number of threads reading and transforming scans')
+    parser.add_argument('--scan_store', type=str, default=None,
+                        help='(optional) Packed scans of laser_dir, written by scan_store.py')
+    parser.add_argument('--voxel_size', type=float, default=None,
+                        help='(optional) If supplied, keep one point per voxel of this size (metres)')
 
     args = parser.parse_args()
 
     lidar = re.search('(lms_front|lms_rear|ldmrs)', args.laser_dir).group(0)
-    timestamps_path = os.path.join(args.laser_dir, os.pardir, lidar + '.timestamps')
-    with open(timestamps_path) as timestamps_file:
-        start_time = int(next(timestamps_file).split(' ')[0])
+    start_time = int(TimestampIndex(os.path.join(args.laser_dir, os.pardir, lidar + '.timestamps'))[0])
 
     end_time = start_time + 2e7
 
     pointcloud, reflectance = build_pointcloud(args.laser_dir, args.poses_file,
-                                               args.extrinsics_dir, start_time, end_time)
+                                               args.extrinsics_dir, start_time, end_time, workers=args.workers,
+                                               scan_store=args.scan_store, voxel_size=args.voxel_size)
 
     if reflectance is not None:
         colours = (reflectance - reflectance.min()) / (reflectance.max() - reflectance.min())
@@ -14,9 +14,16 @@
 
 import re
 import os
+import threading
 import numpy as np
 import scipy.interpolate as interp
 from scipy.ndimage import map_coordinates
+from array_utils import load_cached_npy
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
 
 
 class CameraModel:
@@ -28,8 +35,10 @@ class CameraModel:
         focal_length (tuple[float]): Focal length of the camera in horizontal and vertical axis, in pixels.
         principal_point (tuple[float]): Principal point of camera for pinhole projection model, in pixels.
         G_camera_image (:obj: `numpy.matrixlib.defmatrix.matrix`): Transform from image frame to camera frame.
+        G_image_camera (:obj: `numpy.ndarray`): Transform from camera frame to image frame (inverse of G_camera_image).
         bilinear_lut (:obj: `numpy.ndarray`): Look-up table for undistortion of images, mapping pixels in an undistorted
-            image to pixels in the distorted image
+            image to pixels in the distorted image. Memory-mapped from the LUT file.
+        lut_path (str): Path to the LUT file. The remap tables built from it are cached next to it.
 
     """
 
@@ -46,7 +55,11 @@ class CameraModel:
         self.focal_length = None
         self.principal_point = None
         self.G_camera_image = None
+        self.G_image_camera = None
         self.bilinear_lut = None
+        self.lut_path = None
+        self._remap_tables = {}
+        self._remap_lock = threading.Lock()
 
         self.__load_intrinsics(models_dir, images_dir)
         self.__load_lut(models_dir, images_dir)
@@ -67,19 +80,45 @@ class CameraModel:
             project into the image are discarded.
 
         """
+        return self.__project_image_frame(np.dot(self.G_image_camera, self.__homogeneous(xyz)), image_size)
+
+    def project_frames(self, xyz, G_camera_pointcloud, image_size):
+        """Projects one pointcloud into many frames of the camera at once.
+
+        Args:
+            xyz (:obj: `numpy.ndarray`): 3xn or 4xn array, where each column is a point relative to the pointcloud frame.
+            G_camera_pointcloud (:obj: `numpy.ndarray`): kx4x4 array of transforms from the pointcloud frame to the
+                camera frame of each of the k frames.
+            image_size (tuple[int]): dimensions of image in pixels
+
+        Returns:
+            list[tuple[numpy.ndarray]]: for each frame, the 2xm array of (u, v) pixel coordinates and the array of m
+                depth values of the points that project into it, as returned by `project`.
+
+        Note:
+            The points are transformed into every frame with one batched product, which holds a kx4xn array.
+            Split long sequences of frames to bound memory.
+
+        """
+        G_image_pointcloud = np.matmul(self.G_image_camera, np.asarray(G_camera_pointcloud).reshape((-1, 4, 4)))
+        xyzw = np.matmul(G_image_pointcloud, self.__homogeneous(xyz))
+        return [self.__project_image_frame(frame_xyzw, image_size) for frame_xyzw in xyzw]
+
+    @staticmethod
+    def __homogeneous(xyz):
+        xyz = np.asarray(xyz)
         if xyz.shape[0] == 3:
-            xyz = np.stack((xyz, np.ones((1, xyz.shape[1]))))
-        xyzw = np.linalg.solve(self.G_camera_image, xyz)
+            xyz = np.vstack((xyz, np.ones((1, xyz.shape[1]))))
+        return xyz
 
+    def __project_image_frame(self, xyzw, image_size):
         # Find which points lie in front of the camera
-        in_front = [i for i in range(0, xyzw.shape[1]) if xyzw[2, i] >= 0]
-        xyzw = xyzw[:, in_front]
+        xyzw = xyzw[:, xyzw[2, :] >= 0]
 
         uv = np.vstack((self.focal_length[0] * xyzw[0, :] / xyzw[2, :] + self.principal_point[0],
                         self.focal_length[1] * xyzw[1, :] / xyzw[2, :] + self.principal_point[1]))
 
-        in_img = [i for i in range(0, uv.shape[1])
-                  if 0.5 <= uv[0, i] <= image_size[1] and 0.5 <= uv[1, i] <= image_size[0]]
+        in_img = (0.5 <= uv[0, :]) & (uv[0, :] <= image_size[1]) & (0.5 <= uv[1, :]) & (uv[1, :] <= image_size[0])
 
         return uv[:, in_img], np.ravel(xyzw[2, in_img])
 
@@ -100,16 +139,52 @@ class CameraModel:
         if image.shape[0] * image.shape[1] != self.bilinear_lut.shape[0]:
             raise ValueError('Incorrect image size for camera model')
 
-        lut = self.bilinear_lut[:, 1::-1].T.reshape((2, image.shape[0], image.shape[1]))
-
         if len(image.shape) == 1:
             raise ValueError('Undistortion function only works with multi-channel images')
 
-        undistorted = np.rollaxis(np.array([map_coordinates(image[:, :, channel], lut, order=1)
-                                for channel in range(0, image.shape[2])]), 0, 3)
+        map_x, map_y = self.get_remap_tables(image.shape[0], image.shape[1])
+
+        if cv2 is not None:
+            # cv2.remap is much less accurate on float64 images than on float32 ones, so they are remapped as float32
+            src = image.astype(np.float32) if image.dtype == np.float64 else image
+            undistorted = cv2.remap(src, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        else:
+            lut = np.stack((map_y, map_x))
+            undistorted = np.rollaxis(np.array([map_coordinates(image[:, :, channel], lut, order=1)
+                                    for channel in range(0, image.shape[2])]), 0, 3)
 
         return undistorted.astype(image.dtype)
 
+    def get_remap_tables(self, height, width):
+        """Gets the undistortion LUT as a pair of maps for `cv2.remap`.
+
+        The maps are built once and cached next to the LUT file, in `<model>_distortion_lut_remap_<width>x<height>.npy`,
+        which is memory-mapped on later loads. The cache is rebuilt if the LUT file is newer, and kept in memory only if
+        it cannot be written. Safe to call from several threads and processes at once.
+
+        Args:
+            height (int): height of the images in pixels.
+            width (int): width of the images in pixels.
+
+        Returns:
+            numpy.ndarray: float32 map of x coordinates in the distorted image, of shape (height, width).
+            numpy.ndarray: float32 map of y coordinates in the distorted image, of shape (height, width).
+
+        """
+        with self._remap_lock:
+            if (height, width) not in self._remap_tables:
+                cache_path = os.path.splitext(self.lut_path)[0] + '_remap_%ix%i.npy' % (width, height)
+                maps = load_cached_npy(cache_path, self.lut_path, lambda: self.__build_remap_tables(height, width))
+                self._remap_tables[(height, width)] = (maps[0], maps[1])
+            return self._remap_tables[(height, width)]
+
+    def __build_remap_tables(self, height, width):
+        maps = self.bilinear_lut.T.reshape((2, height, width)).astype(np.float32)
+        # map_coordinates leaves pixels that map outside the image black, without blending in the border
+        outside = (maps[0] < 0) | (maps[0] > width - 1) | (maps[1] < 0) | (maps[1] > height - 1)
+        maps[:, outside] = -2
+        return maps
+
     def __get_model_name(self, images_dir):
         self.camera = re.search('(stereo|mono_(left|right|rear))', images_dir).group(0)
         if self.camera == 'stereo':
@@ -138,12 +213,13 @@ class CameraModel:
             for line in intrinsics_file:
                 G_camera_image.append([float(x) for x in line.split()])
             self.G_camera_image = np.array(G_camera_image)
+            self.G_image_camera = np.linalg.inv(self.G_camera_image)
 
     def __load_lut(self, models_dir, images_dir):
         model_name = self.__get_model_name(images_dir)
-        lut_path = os.path.join(models_dir, model_name + '_distortion_lut.bin')
+        self.lut_path = os.path.join(models_dir, model_name + '_distortion_lut.bin')
 
-        lut = np.fromfile(lut_path, np.double)
+        lut = np.memmap(self.lut_path, np.double, mode='r')
         lut = lut.reshape([2, lut.size // 2])
         self.bilinear_lut = lut.transpose()
 
@@ -0,0 +1,63 @@
+import os
+import json
+import shutil
+import tempfile
+import hashlib
+import numpy as np
+
+
+class FrameCache(object):
+    """Content-addressed on-disk cache of preprocessed arrays.
+
+    Each entry is a single .npy file named after a digest of the source files (path, size and mtime) and of the
+    parameters used to produce it, so changing any of them results in a different entry. Entries are copied in and
+    out through a temporary file and a rename, so an existing entry is always complete.
+
+    """
+
+    def __init__(self, cache_dir):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+
+    def key(self, kind, source_paths, **params):
+        digest = hashlib.sha1()
+        digest.update(json.dumps([kind, sorted(params.items())]).encode('utf-8'))
+        for path in source_paths:
+            stat = os.stat(path)
+            digest.update(json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime]).encode('utf-8'))
+        return kind + '-' + digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def contains(self, key):
+        return os.path.isfile(self.path(key))
+
+    def load(self, key, mmap_mode='r'):
+        if not self.contains(key):
+            return None
+        return np.load(self.path(key), mmap_mode=mmap_mode)
+
+    def fetch(self, key, dst_path):
+        if not self.contains(key):
+            return False
+        _copy_atomic(self.path(key), dst_path)
+        return True
+
+    def store(self, key, src_path):
+        _copy_atomic(src_path, self.path(key))
+
+
+def _copy_atomic(src_path, dst_path):
+    # The temporary file is unique, so concurrent copies to the same destination never share it
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(dst_path)))
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file, open(src_path, 'rb') as src_file:
+            shutil.copyfileobj(src_file, tmp_file)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, dst_path)
+    except BaseException:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
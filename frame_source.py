@@ -0,0 +1,108 @@
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+class PrefetchingFrameSource(object):
+    """Loads the frames of a sequence ahead of their consumer on background threads.
+
+    Loading pauses while `max_queued` frames are waiting to be consumed, so memory stays bounded however slow the
+    consumer is. Frames are returned in order.
+
+    Attributes:
+        items (list): items to load, one per frame, e.g. image paths.
+
+    """
+
+    def __init__(self, items, load, workers=2, max_queued=16):
+        """Creates a frame source. Nothing is loaded until it is iterated.
+
+        Args:
+            items (list): items to load, one per frame.
+            load (callable): function that takes an item and returns its frame. It runs on the worker threads, so it
+                should spend most of its time without the GIL (image decoding, cv2 and most numpy operations do).
+            workers (int): number of threads loading frames.
+            max_queued (int): maximum number of frames loaded ahead.
+
+        """
+        self.items = items
+        self._load = load
+        self._workers = max(1, workers)
+        self._max_queued = max(1, max_queued)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        """Yields (item, frame) for every item, in order. Errors raised by `load` are raised here."""
+        pool = ThreadPool(self._workers)
+        results = Queue(self._max_queued)
+        stopped = threading.Event()
+
+        def produce():
+            for item in self.items:
+                if stopped.is_set():
+                    break
+                # Blocks while max_queued frames are waiting to be consumed
+                results.put((item, pool.apply_async(self._load, (item,))))
+            results.put(None)
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                entry = results.get()
+                if entry is None:
+                    break
+                yield entry[0], entry[1].get()
+        finally:
+            stopped.set()
+            while producer.is_alive():
+                # Unblocks the producer if the consumer stopped early
+                try:
+                    results.get_nowait()
+                except Empty:
+                    pass
+                producer.join(0.01)
+            pool.terminate()
+            pool.join()
+
+
+def play(frames, display, fps=None):
+    """Displays frames at a target rate, dropping the ones that are late.
+
+    Args:
+        frames (iterable): frames to display, e.g. a `PrefetchingFrameSource`.
+        display (callable): function that takes a frame and displays it.
+        fps (float): (optional) target rate. A frame is dropped if the next one is already due when it becomes
+            available, unless playback is late only because it waited for the frame to be loaded. If not supplied,
+            every frame is displayed as soon as it is available.
+
+    Returns:
+        int: number of frames displayed.
+        int: number of frames dropped.
+
+    """
+    shown = dropped = 0
+    start = requested = time.time()
+    for i, frame in enumerate(frames):
+        if fps:
+            now = time.time()
+            # Lateness caused by waiting for the frame to be loaded is not made up, dropping frames would not help
+            start += max(0, min(now - requested, now - (start + i / float(fps))))
+            due = start + i / float(fps)
+            if now > due + 1.0 / fps:
+                dropped += 1
+                requested = time.time()
+                continue
+            if now < due:
+                time.sleep(due - now)
+        display(frame)
+        shown += 1
+        requested = time.time()
+    return shown, dropped
@@ -13,14 +13,28 @@
 ###############################################################################
 
 import re
+import time
+from collections import OrderedDict
 import numpy as np
-from scipy.misc import imresize, imsave, imread
+from scipy.misc import imsave, imread
+from scipy.ndimage import convolve, map_coordinates
 from PIL import Image
 from colour_demosaicing import demosaicing_CFA_Bayer_bilinear as demosaic
 
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
 BAYER_STEREO = 'gbrg'
 BAYER_MONO = 'rggb'
 
+# Weights of rgb_2_grey
+GREY_WEIGHTS = {'r': 0.299, 'g': 0.587, 'b': 0.114}
+# Interpolation kernels of the bilinear demosaic
+_BAYER_KERNEL_G = np.array([[0, 1, 0], [1, 4, 1], [0, 1, 0]], dtype=np.float32) / 4
+_BAYER_KERNEL_RB = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]], dtype=np.float32) / 4
+
 
 def load_image(image_path, model=None):
     """Loads and rectifies an image from file.
@@ -33,17 +47,10 @@ def load_image(image_path, model=None):
         numpy.ndarray: demosaiced and optionally undistorted image
 
     """
+    pattern = get_bayer_pattern(image_path, model)
+
     if model:
-        camera = model.camera
-    else:
-        camera = re.search('(stereo|mono_(left|right|rear))', image_path).group(0)
-    if camera == 'stereo':
-        pattern = BAYER_STEREO
-    else:
-        pattern = BAYER_MONO
-    
-    if model:    
-        img = demosaic(Image.open(image_path), pattern)    
+        img = demosaic(Image.open(image_path), pattern)
         img = model.undistort(img)
         img = rgb_2_grey(img)
     else:
@@ -55,6 +62,145 @@ def non_demosaic_load(image_path):
     return imread(image_path)
 
 
+def get_bayer_pattern(image_path, model=None):
+    if model:
+        camera = model.camera
+    else:
+        camera = re.search('(stereo|mono_(left|right|rear))', image_path).group(0)
+    if camera == 'stereo':
+        return BAYER_STEREO
+    return BAYER_MONO
+
+
+def bayer_to_grey(mosaic, pattern):
+    """Computes the luminance of a Bayer mosaic without demosaicing it to RGB.
+
+    Bilinear demosaicing and `rgb_2_grey` are both linear, so the grey image is the sum of two convolutions of the
+    mosaic: one over the red and blue pixels, weighted by their grey weights, and one over the green pixels.
+
+    Args:
+        mosaic (numpy.ndarray): raw image. Its top left pixel must be the first one of `pattern`.
+        pattern (str): Bayer pattern, e.g. 'gbrg'.
+
+    Returns:
+        numpy.ndarray: float32 grey image
+
+    """
+    tile = np.array([GREY_WEIGHTS[c] for c in pattern], dtype=np.float32).reshape((2, 2))
+    is_green = np.array([c == 'g' for c in pattern]).reshape((2, 2))
+    reps = ((mosaic.shape[0] + 1) // 2, (mosaic.shape[1] + 1) // 2)
+    rb_weights = np.tile(np.where(is_green, 0, tile), reps)[:mosaic.shape[0], :mosaic.shape[1]]
+    g_weights = np.tile(np.where(is_green, tile, 0), reps)[:mosaic.shape[0], :mosaic.shape[1]]
+    mosaic = mosaic.astype(np.float32)
+    # Same borders as the bilinear demosaic, which convolves with scipy's default mode ('reflect', edge repeated)
+    if cv2 is not None:
+        return (cv2.filter2D(mosaic * rb_weights, -1, _BAYER_KERNEL_RB, borderType=cv2.BORDER_REFLECT) +
+                cv2.filter2D(mosaic * g_weights, -1, _BAYER_KERNEL_G, borderType=cv2.BORDER_REFLECT))
+    return (convolve(mosaic * rb_weights, _BAYER_KERNEL_RB, mode='reflect') +
+            convolve(mosaic * g_weights, _BAYER_KERNEL_G, mode='reflect'))
+
+
+def load_grey_crop(image_path, model=None, crop=None):
+    """Loads the undistorted grey centre crop of an image, the same as cropping `load_image(image_path, model)`.
+
+    The luminance is computed straight from the Bayer mosaic (see `bayer_to_grey`), only over the pixels that the
+    crop window samples, and only that single channel is undistorted.
+
+    Args:
+        image_path (str): path to an image from the dataset.
+        model (camera_model.CameraModel): if supplied, model will be used to undistort image.
+        crop (tuple[int]): (optional) width and height of the centre crop of the undistorted image.
+
+    Returns:
+        numpy.ndarray: undistorted and cropped grey image
+
+    """
+    if not model:
+        img = non_demosaic_load(image_path)
+        return crop_image(img, crop[0], crop[1]) if crop else img
+
+    mosaic = np.asarray(Image.open(image_path))
+    height, width = mosaic.shape[:2]
+    crop_width, crop_height = crop if crop else (width, height)
+    startx = width // 2 - (crop_width // 2)
+    starty = height // 2 - (crop_height // 2)
+    map_x, map_y = model.get_remap_tables(height, width)
+    map_x = map_x[starty:starty + crop_height, startx:startx + crop_width]
+    map_y = map_y[starty:starty + crop_height, startx:startx + crop_width]
+
+    # Mosaic pixels sampled by the crop, with a margin for the demosaic kernels. The window starts on an even pixel
+    # so that it keeps the Bayer pattern
+    inside = map_x >= 0
+    if not inside.any():
+        return np.zeros((crop_height, crop_width), dtype=np.uint8)
+    x0 = max(int(np.floor(map_x[inside].min())) - 1, 0) // 2 * 2
+    y0 = max(int(np.floor(map_y[inside].min())) - 1, 0) // 2 * 2
+    x1 = min(int(np.ceil(map_x[inside].max())) + 3, width)
+    y1 = min(int(np.ceil(map_y[inside].max())) + 3, height)
+    grey = bayer_to_grey(mosaic[y0:y1, x0:x1], get_bayer_pattern(image_path, model))
+
+    # Pixels outside the image keep their negative coordinates, so they stay black
+    map_x = np.where(inside, map_x - x0, map_x).astype(np.float32)
+    map_y = np.where(inside, map_y - y0, map_y).astype(np.float32)
+    if cv2 is not None:
+        img = cv2.remap(grey, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+    else:
+        img = map_coordinates(grey, np.stack((map_y, map_x)), order=1)
+    return np.clip(np.round(img), 0, 255).astype(np.uint8)
+
+
+REDUCED_DECODE_FACTORS = (8, 4, 2)
+
+
+def get_reduced_decode_factor(crop, scale):
+    """Largest factor by which an image can be reduced while decoding, so that the crop still has at least the
+    requested output resolution.
+
+    Args:
+        crop (tuple[int]): width and height of the centre crop (full resolution).
+        scale (tuple[int]): width and height of the output image.
+
+    Returns:
+        int: one of REDUCED_DECODE_FACTORS, or 1 if the image must be decoded at full resolution.
+
+    """
+    if cv2 is None or not crop or not scale:
+        return 1
+    for factor in REDUCED_DECODE_FACTORS:
+        if crop[0] >= scale[0] * factor and crop[1] >= scale[1] * factor:
+            return factor
+    return 1
+
+
+def load_reduced(image_path, crop, scale, out=None, backend=None):
+    """Loads a grayscale image at reduced resolution, then crops and scales it.
+
+    The image is decoded with OpenCV's IMREAD_REDUCED_GRAYSCALE_<factor> (see `get_reduced_decode_factor`), the crop
+    is mapped to the reduced image and the result is resized to `scale`. Crop boundaries are rounded to reduced pixels,
+    so the output may differ slightly from `crop_and_scale(non_demosaic_load(image_path), crop, scale)`; see
+    `compare_reduced_decode`.
+
+    Args:
+        image_path (str): path to a grayscale image.
+        crop (tuple[int]): width and height of the centre crop (full resolution).
+        scale (tuple[int]): width and height of the output image.
+        out (numpy.ndarray): (optional) output array.
+        backend (str): (optional) resize backend, see `get_resize_backend`.
+
+    Returns:
+        numpy.ndarray: cropped and scaled image
+
+    """
+    factor = get_reduced_decode_factor(crop, scale)
+    if factor == 1:
+        return crop_and_scale(non_demosaic_load(image_path), crop, scale, out=out, backend=backend)
+    img = cv2.imread(image_path, getattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_' + str(factor)))
+    if img is None:
+        raise IOError('Could not read image ' + image_path)
+    reduced_crop = [int(round(float(c) / factor)) for c in crop]
+    return crop_and_scale(img, reduced_crop, scale, out=out, backend=backend)
+
+
 def crop_image(num_array, cropx, cropy):
     y = num_array.shape[0]
     x = num_array.shape[1]
@@ -62,8 +208,140 @@ def crop_image(num_array, cropx, cropy):
     starty = y // 2 - (cropy // 2)
     return num_array[starty:starty + cropy, startx:startx+cropx]    
 
-def scale_image(num_array, sizex, sizey):
-    return imresize(num_array, (sizey,sizex))
+def scale_image(num_array, sizex, sizey, backend=None):
+    return resize_into(num_array, np.empty((sizey, sizex) + num_array.shape[2:], dtype=num_array.dtype), backend)
+
+
+def _resize_pil(src, out):
+    # Same interpolation as scipy.misc.imresize (bilinear). PIL copies strided arrays anyway
+    out[...] = np.asarray(Image.fromarray(np.ascontiguousarray(src)).resize((out.shape[1], out.shape[0]), Image.BILINEAR))
+
+
+def _resize_cv2(src, out):
+    # cv2 reads a crop view in place, through its row stride
+    resized = cv2.resize(src, (out.shape[1], out.shape[0]), dst=out, interpolation=cv2.INTER_AREA)
+    if resized is not out:
+        out[...] = resized.reshape(out.shape)
+
+
+def _supports_numpy(src_shape, out_shape):
+    return src_shape[0] % out_shape[0] == 0 and src_shape[1] % out_shape[1] == 0
+
+
+def _resize_numpy(src, out):
+    # Average of each (fy x fx) block, rounded to the nearest integer. Splitting the axes of a crop view does not
+    # copy it
+    fy = src.shape[0] // out.shape[0]
+    fx = src.shape[1] // out.shape[1]
+    blocks = src.reshape((out.shape[0], fy, out.shape[1], fx) + src.shape[2:]).astype(np.uint32)
+    out[...] = (blocks.sum(axis=(1, 3)) + fy * fx // 2) // (fy * fx)
+
+
+# name -> (resize function, function that tells if a (src shape, out shape) resize is supported or None)
+RESIZE_BACKENDS = OrderedDict()
+DEFAULT_RESIZE_BACKEND = 'pil'
+AUTO_RESIZE_BACKEND = 'auto'
+
+
+def register_resize_backend(name, resize, supports=None):
+    """Registers a resize backend.
+
+    Args:
+        name (str): name of the backend.
+        resize (callable): resize(src, out) resizes `src` into the preallocated array `out`.
+        supports (callable): (optional) supports(src_shape, out_shape) returns False if the backend can not do the resize.
+
+    """
+    RESIZE_BACKENDS[name] = (resize, supports)
+
+
+# In order of preference for 'auto'
+if cv2 is not None:
+    register_resize_backend('cv2', _resize_cv2)
+register_resize_backend('numpy', _resize_numpy, _supports_numpy)
+register_resize_backend('pil', _resize_pil)
+
+
+def get_resize_backend(name, src_shape, out_shape):
+    """Returns the resize function of a backend.
+
+    Args:
+        name (str): name of a registered backend, 'auto' (first registered backend that supports the resize) or None
+            (DEFAULT_RESIZE_BACKEND).
+        src_shape (tuple[int]): shape of the image to resize.
+        out_shape (tuple[int]): shape of the resized image.
+
+    Returns:
+        callable: resize(src, out)
+
+    Raises:
+        ValueError: if the backend does not exist or does not support the resize.
+
+    """
+    if name is None:
+        name = DEFAULT_RESIZE_BACKEND
+    if name == AUTO_RESIZE_BACKEND:
+        for resize, supports in RESIZE_BACKENDS.values():
+            if supports is None or supports(src_shape, out_shape):
+                return resize
+    if name not in RESIZE_BACKENDS:
+        raise ValueError('Unknown resize backend: ' + name)
+    resize, supports = RESIZE_BACKENDS[name]
+    if supports is not None and not supports(src_shape, out_shape):
+        raise ValueError('Resize backend ' + name + ' does not support resizing ' + str(src_shape) + ' to ' +
+                         str(out_shape))
+    return resize
+
+
+def resize_into(num_array, out, backend=None):
+    if num_array.shape[0:2] == out.shape[0:2]:
+        out[...] = num_array
+    else:
+        # Crops are passed as views, backends that need contiguous images copy them
+        get_resize_backend(backend, num_array.shape, out.shape)(num_array, out)
+    return out
+
+
+def crop_and_scale(num_array, crop=None, scale=None, out=None, backend=None):
+    """Crops the centre of an image and scales it, writing the result into a preallocated array.
+
+    Args:
+        num_array (numpy.ndarray): image.
+        crop (tuple[int]): (optional) width and height of the centre crop.
+        scale (tuple[int]): (optional) width and height of the output image.
+        out (numpy.ndarray): (optional) output array. It is allocated if not supplied.
+        backend (str): (optional) resize backend, see `get_resize_backend`.
+
+    Returns:
+        numpy.ndarray: cropped and scaled image (`out` if supplied)
+
+    """
+    if crop:
+        num_array = crop_image(num_array, crop[0], crop[1])
+    if out is None:
+        size = scale if scale else (num_array.shape[1], num_array.shape[0])
+        out = np.empty((size[1], size[0]) + num_array.shape[2:], dtype=num_array.dtype)
+    return resize_into(num_array, out, backend)
+
+
+def benchmark_resize_backends(num_array, crop=None, scale=None, repeat=100):
+    """Times `crop_and_scale` with every registered backend that supports the resize.
+
+    Returns:
+        dict: backend name -> seconds per image
+
+    """
+    out = crop_and_scale(num_array, crop, scale)
+    cropped_shape = crop_image(num_array, crop[0], crop[1]).shape if crop else num_array.shape
+    results = OrderedDict()
+    for name, (resize, supports) in RESIZE_BACKENDS.items():
+        if supports is not None and not supports(cropped_shape, out.shape):
+            continue
+        start = time.time()
+        for _ in range(repeat):
+            crop_and_scale(num_array, crop, scale, out=out, backend=name)
+        results[name] = (time.time() - start) / repeat
+    return results
 
 def save_image(num_array, path):
     imsave(path, num_array)
@@ -72,4 +350,95 @@ def savez_compressed(path, array):
     np.savez_compressed(path, array)
 
 def rgb_2_grey(img):
-    return np.dot(img[...,:3],[0.299, 0.587, 0.114]).astype(img.dtype)
\ No newline at end of file
+    return np.dot(img[...,:3],[GREY_WEIGHTS['r'], GREY_WEIGHTS['g'], GREY_WEIGHTS['b']]).astype(img.dtype)
+
+
+def compare_reduced_decode(image_paths, crop, scale, backend=None):
+    """Compares `load_reduced` with decoding at full resolution followed by `crop_and_scale`.
+
+    Returns:
+        dict: images per second of both paths ('full', 'reduced'), and mean and maximum absolute pixel difference
+            ('mean_difference', 'max_difference').
+
+    """
+    start = time.time()
+    full = [crop_and_scale(non_demosaic_load(path), crop, scale, backend=backend) for path in image_paths]
+    full_time = time.time() - start
+    start = time.time()
+    reduced = [load_reduced(path, crop, scale, backend=backend) for path in image_paths]
+    reduced_time = time.time() - start
+    differences = np.abs(np.array(full, dtype=np.int16) - np.array(reduced, dtype=np.int16))
+    return {'full': len(image_paths) / full_time,
+            'reduced': len(image_paths) / reduced_time,
+            'mean_difference': differences.mean(),
+            'max_difference': differences.max()}
+
+
+def compare_grey_crop(image_paths, model, crop=None):
+    """Compares `load_grey_crop` with cropping `load_image`, e.g. with a crop that reaches the edges of the image.
+
+    Args:
+        image_paths (list[str]): paths to images from the dataset.
+        model (camera_model.CameraModel): model used to undistort the images.
+        crop (tuple[int]): (optional) width and height of the centre crop. The whole image by default.
+
+    Returns:
+        dict: images per second of both paths ('full', 'fused'), and mean and maximum absolute pixel difference
+            ('mean_difference', 'max_difference').
+
+    """
+    start = time.time()
+    full = [load_image(path, model) for path in image_paths]
+    full = [crop_image(img, crop[0], crop[1]) if crop else img for img in full]
+    full_time = time.time() - start
+    start = time.time()
+    fused = [load_grey_crop(path, model, crop) for path in image_paths]
+    fused_time = time.time() - start
+    differences = np.abs(np.array(full, dtype=np.int16) - np.array(fused, dtype=np.int16))
+    return {'full': len(image_paths) / full_time,
+            'fused': len(image_paths) / fused_time,
+            'mean_difference': differences.mean(),
+            'max_difference': differences.max()}
+
+
+# Examples (KITTI):
+# python image.py --images ~/KITTI/sequences/00/image_0/000000.png --crop 500 375 --scale 128 96
+# python image.py --images ~/KITTI/sequences/00/image_0/00000*.png --crop 500 375 --scale 128 96 --reduced
+# Example (RobotCar, crop up to the edges of the image):
+# python image.py --images ~/robotcar/stereo/centre/14*.png --crop 1280 960 --grey_crop --models_dir ~/robotcar/models
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare the resize backends or the decode paths')
+    parser.add_argument('--images', nargs='+', type=str, default=None,
+                        help='(optional) Images. A random 1241x376 image by default')
+    parser.add_argument('--crop', nargs=2, default=None, type=int, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--scale', nargs=2, default=None, type=int, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--backend', type=str, default=None, help='Resize backend used with --reduced')
+    parser.add_argument('--reduced', action='store_true',
+                        help='Compare decoding at reduced resolution with decoding at full resolution')
+    parser.add_argument('--grey_crop', action='store_true',
+                        help='Compare the grey crop computed from the Bayer mosaic with cropping the undistorted image')
+    parser.add_argument('--models_dir', type=str, default=None, help='Directory containing camera models')
+    args = parser.parse_args()
+
+    if args.grey_crop:
+        from camera_model import CameraModel
+        results = compare_grey_crop(args.images, CameraModel(args.models_dir, args.images[0]), args.crop)
+        print('full: %.1f images/s, fused: %.1f images/s (x%.2f)' %
+              (results['full'], results['fused'], results['fused'] / results['full']))
+        print('Pixel difference: mean %.3f, max %d' % (results['mean_difference'], results['max_difference']))
+    elif args.reduced:
+        print('Reduction factor: %d' % get_reduced_decode_factor(args.crop, args.scale))
+        results = compare_reduced_decode(args.images, args.crop, args.scale, args.backend)
+        print('full: %.1f images/s, reduced: %.1f images/s (x%.2f)' %
+              (results['full'], results['reduced'], results['reduced'] / results['full']))
+        print('Pixel difference: mean %.3f, max %d' % (results['mean_difference'], results['max_difference']))
+    else:
+        if args.images:
+            img = non_demosaic_load(args.images[0])
+        else:
+            img = np.random.randint(0, 256, (376, 1241)).astype(np.uint8)
+        for name, seconds in benchmark_resize_backends(img, args.crop, args.scale, args.repeat).items():
+            print('%s: %.3f ms per image' % (name, seconds * 1000))
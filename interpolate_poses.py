@@ -12,11 +12,9 @@
 #
 ################################################################################
 
-import bisect
-import csv
 import numpy as np
-import numpy.matlib as ml
 from transform import *
+from pose_log import PoseLog
 
 
 def interpolate_vo_poses(vo_path, pose_timestamps, origin_timestamp):
@@ -28,34 +26,25 @@ def interpolate_vo_poses(vo_path, pose_timestamps, origin_timestamp):
         origin_timestamp (int): UNIX timestamp of origin frame. Poses will be reported relative to this frame.
 
     Returns:
-        list[numpy.matrixlib.defmatrix.matrix]: SE3 matrix representing interpolated pose for each requested timestamp.
+        numpy.ndarray: mx4x4 array of SE3 matrices representing the interpolated pose for each requested timestamp.
 
     """
-    with open(vo_path) as vo_file:
-        vo_reader = csv.reader(vo_file)
-        headers = next(vo_file)
+    vo = PoseLog(vo_path)
 
-        vo_timestamps = [0]
-        abs_poses = [ml.identity(4)]
+    lower_timestamp = min(min(pose_timestamps), origin_timestamp)
+    upper_timestamp = max(max(pose_timestamps), origin_timestamp)
 
-        lower_timestamp = min(min(pose_timestamps), origin_timestamp)
-        upper_timestamp = max(max(pose_timestamps), origin_timestamp)
+    # Rows from the first one at or after lower_timestamp to the first one at or after upper_timestamp
+    start = int(np.searchsorted(vo.timestamps, lower_timestamp, side='left'))
+    end = min(int(np.searchsorted(vo.timestamps, upper_timestamp, side='left')) + 1, len(vo))
 
-        for row in vo_reader:
-            timestamp = int(row[0])
-            if timestamp < lower_timestamp:
-                vo_timestamps[0] = timestamp
-                continue
+    vo_timestamps = [int(vo.timestamps[start - 1]) if start > 0 else 0] + vo.timestamps[start:end].tolist()
 
-            vo_timestamps.append(timestamp)
-
-            xyzrpy = [float(v) for v in row[2:8]]
-            rel_pose = build_se3_transform(xyzrpy)
-            abs_pose = abs_poses[-1] * rel_pose
-            abs_poses.append(abs_pose)
-
-            if timestamp >= upper_timestamp:
-                break
+    rel_poses = vo.se3_transforms(start, end)
+    abs_poses = np.empty((len(rel_poses) + 1, 4, 4))
+    abs_poses[0] = np.identity(4)
+    for i in range(0, len(rel_poses)):
+        abs_poses[i + 1] = np.dot(abs_poses[i], rel_poses[i])
 
     return interpolate_poses(vo_timestamps, abs_poses, pose_timestamps, origin_timestamp)
 
@@ -69,31 +58,18 @@ def interpolate_ins_poses(ins_path, pose_timestamps, origin_timestamp):
         origin_timestamp (int): UNIX timestamp of origin frame. Poses will be reported relative to this frame.
 
     Returns:
-        list[numpy.matrixlib.defmatrix.matrix]: SE3 matrix representing interpolated pose for each requested timestamp.
+        numpy.ndarray: mx4x4 array of SE3 matrices representing the interpolated pose for each requested timestamp.
 
     """
-    with open(ins_path) as ins_file:
-        ins_reader = csv.reader(ins_file)
-        headers = next(ins_file)
-
-        ins_timestamps = [0]
-        abs_poses = [ml.identity(4)]
-
-        upper_timestamp = max(max(pose_timestamps), origin_timestamp)
-
-        for row in ins_reader:
-            timestamp = int(row[0])
-            ins_timestamps.append(timestamp)
+    ins = PoseLog(ins_path)
 
-            xyzrpy = [float(v) for v in row[2:8]]
-            abs_pose = build_se3_transform(xyzrpy)
-            abs_poses.append(abs_pose)
+    upper_timestamp = max(max(pose_timestamps), origin_timestamp)
 
-            if timestamp >= upper_timestamp:
-                break
+    # Rows up to the first one at or after upper_timestamp
+    end = min(int(np.searchsorted(ins.timestamps, upper_timestamp, side='left')) + 1, len(ins))
 
-    ins_timestamps = ins_timestamps[1:]
-    abs_poses = abs_poses[1:]
+    ins_timestamps = ins.timestamps[:end].tolist()
+    abs_poses = ins.se3_transforms(0, end)
 
     return interpolate_poses(ins_timestamps, abs_poses, pose_timestamps, origin_timestamp)
 
@@ -103,39 +79,42 @@ def interpolate_poses(pose_timestamps, abs_poses, requested_timestamps, origin_t
 
     Args:
         pose_timestamps (list[int]): Timestamps of supplied poses. Must be in ascending order.
-        abs_poses (list[numpy.matrixlib.defmatrix.matrix]): SE3 matrices representing poses at the timestamps specified.
+        abs_poses (numpy.ndarray): nx4x4 array (or list) of SE3 matrices representing poses at the timestamps specified.
         requested_timestamps (list[int]): Timestamps for which interpolated timestamps are required.
         origin_timestamp (int): UNIX timestamp of origin frame. Poses will be reported relative to this frame.
 
     Returns:
-        list[numpy.matrixlib.defmatrix.matrix]: SE3 matrix representing interpolated pose for each requested timestamp.
+        numpy.ndarray: mx4x4 array of SE3 matrices representing the interpolated pose for each requested timestamp.
 
     Raises:
         ValueError: if pose_timestamps and abs_poses are not the same length
         ValueError: if pose_timestamps is not in ascending order
 
     """
-    requested_timestamps.insert(0, origin_timestamp)
-    requested_timestamps = np.array(requested_timestamps)
-    pose_timestamps = np.array(pose_timestamps)
+    # The caller's list is not modified
+    requested_timestamps = np.concatenate(([origin_timestamp], requested_timestamps))
+    pose_timestamps = np.asarray(pose_timestamps)
+    abs_poses = np.asarray(abs_poses, dtype=np.float64).reshape((-1, 4, 4))
 
     if len(pose_timestamps) != len(abs_poses):
         raise ValueError('Must supply same number of timestamps as poses')
+    if np.any(pose_timestamps[:-1] >= pose_timestamps[1:]):
+        raise ValueError('Pose timestamps must be in ascending order')
 
-    abs_quaternions = np.zeros((4, len(abs_poses)))
-    abs_positions = np.zeros((3, len(abs_poses)))
-    for i, pose in enumerate(abs_poses):
-        if i > 0 and pose_timestamps[i-1] >= pose_timestamps[i]:
-            raise ValueError('Pose timestamps must be in ascending order')
+    abs_quaternions = so3_to_quaternions(abs_poses[:, 0:3, 0:3]).T
+    abs_positions = abs_poses[:, 0:3, 3].T
+
+    return _interpolate(pose_timestamps, abs_quaternions, abs_positions, requested_timestamps)
 
-        abs_quaternions[:, i] = so3_to_quaternion(pose[0:3, 0:3])
-        abs_positions[:, i] = np.ravel(pose[0:3, 3])
 
-    upper_indices = [bisect.bisect(pose_timestamps, pt) for pt in requested_timestamps]
-    lower_indices = [u - 1 for u in upper_indices]
+def _interpolate(pose_timestamps, abs_quaternions, abs_positions, requested_timestamps):
+    # Slerps the 4xn quaternions and lerps the 3xn positions at the requested timestamps, the first of which is the
+    # origin. Returns the poses relative to the origin as an mx4x4 array, without the origin
 
-    if max(upper_indices) >= len(pose_timestamps):
-        upper_indices = [min(i, len(pose_timestamps) - 1) for i in upper_indices]
+    # Same as bisect.bisect for each requested timestamp
+    upper_indices = np.searchsorted(pose_timestamps, requested_timestamps, side='right')
+    lower_indices = upper_indices - 1
+    upper_indices = np.minimum(upper_indices, len(pose_timestamps) - 1)
 
     fractions = (requested_timestamps - pose_timestamps[lower_indices]) / \
                 (pose_timestamps[upper_indices] - pose_timestamps[lower_indices])
@@ -173,7 +152,7 @@ def interpolate_poses(pose_timestamps, abs_poses, requested_timestamps, origin_t
     positions_interp = np.multiply(np.tile((1 - fractions), (3, 1)), positions_lower) \
                        + np.multiply(np.tile(fractions, (3, 1)), positions_upper)
 
-    poses_mat = ml.zeros((4, 4 * len(requested_timestamps)))
+    poses_mat = np.zeros((4, 4 * len(requested_timestamps)))
 
     poses_mat[0, 0::4] = 1 - 2 * np.square(quaternions_interp[2, :]) - \
                          2 * np.square(quaternions_interp[3, :])
@@ -201,8 +180,68 @@ def interpolate_poses(pose_timestamps, abs_poses, requested_timestamps, origin_t
 
     poses_mat = np.linalg.solve(poses_mat[0:4, 0:4], poses_mat)
 
-    poses_out = [0] * (len(requested_timestamps) - 1)
-    for i in range(1, len(requested_timestamps)):
-        poses_out[i - 1] = poses_mat[0:4, i * 4:(i + 1) * 4]
+    # 4x4m block row to a stack of m 4x4 matrices, without the origin
+    return poses_mat[:, 4:].reshape((4, -1, 4)).transpose((1, 0, 2)).copy()
+
+
+class PoseSource(object):
+    """Absolute poses of a VO or INS log, loaded once and interpolated on demand.
+
+    VO relative poses are integrated over the whole log once, so that repeated queries do not re-read the log or
+    re-integrate it. Rotations are converted to quaternions once as well.
+
+    Attributes:
+        path (str): path to the pose log.
+        type (str): 'vo' or 'ins'.
+        timestamps (:obj: `numpy.ndarray`): int64 timestamps of the absolute poses, in ascending order.
+        abs_poses (:obj: `numpy.ndarray`): nx4x4 array of absolute SE3 poses. For VO, the first pose is the identity,
+            at the destination timestamp of the first row.
+
+    """
+
+    def __init__(self, poses_file):
+        """Loads a pose log.
+
+        Args:
+            poses_file (str): path to a vo.csv or ins.csv file.
+
+        Raises:
+            ValueError: if the timestamps of the log are not in ascending order.
+
+        """
+        log = PoseLog(poses_file)
+        self.path = poses_file
+        if log.destination_timestamps is not None:
+            self.type = 'vo'
+            rel_poses = log.se3_transforms()
+            self.timestamps = np.concatenate((log.destination_timestamps[0:1], log.timestamps))
+            self.abs_poses = np.empty((len(rel_poses) + 1, 4, 4))
+            self.abs_poses[0] = np.identity(4)
+            for i in range(0, len(rel_poses)):
+                self.abs_poses[i + 1] = np.dot(self.abs_poses[i], rel_poses[i])
+        else:
+            self.type = 'ins'
+            self.timestamps = np.array(log.timestamps)
+            self.abs_poses = log.se3_transforms()
+
+        if np.any(self.timestamps[:-1] >= self.timestamps[1:]):
+            raise ValueError('Pose timestamps must be in ascending order')
+        self._quaternions = so3_to_quaternions(self.abs_poses[:, 0:3, 0:3]).T
+        self._positions = self.abs_poses[:, 0:3, 3].T
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def interpolate(self, pose_timestamps, origin_timestamp):
+        """Interpolates poses relative to an origin.
+
+        Args:
+            pose_timestamps (list[int]): UNIX timestamps at which interpolated poses are required.
+            origin_timestamp (int): UNIX timestamp of origin frame. Poses will be reported relative to this frame.
+
+        Returns:
+            numpy.ndarray: mx4x4 array of SE3 matrices representing the interpolated pose for each requested timestamp.
 
-    return poses_out
+        """
+        requested_timestamps = np.concatenate(([origin_timestamp], pose_timestamps))
+        return _interpolate(self.timestamps, self._quaternions, self._positions, requested_timestamps)
@@ -16,38 +16,35 @@ import argparse
 import os
 import re
 import matplotlib.pyplot as plt
+from PIL import Image
 from datetime import datetime as dt
 from image import load_image
 from camera_model import CameraModel
+from timestamp_index import TimestampIndex
+from frame_source import PrefetchingFrameSource, play
 
 parser = argparse.ArgumentParser(description='Play back images from a given directory')
 
 parser.add_argument('dir', type=str, help='Directory containing images.')
 parser.add_argument('--models_dir', type=str, default=None, help='(optional) Directory containing camera model. If supplied, images will be undistorted before display')
 parser.add_argument('--scale', type=float, default=1.0, help='(optional) factor by which to scale images before display')
+parser.add_argument('--fps', type=float, default=None, help='(optional) Target playback rate. Frames are dropped when playback falls behind it')
+parser.add_argument('--workers', type=int, default=2, help='(optional) Number of threads decoding images ahead of playback')
 
 args = parser.parse_args()
 
 camera = re.search('(stereo|mono_(left|right|rear))', args.dir).group(0)
 
-timestamps_path = os.path.join(os.path.join(args.dir, os.pardir, camera + '.timestamps'))
-if not os.path.isfile(timestamps_path):
-  timestamps_path = os.path.join(args.dir, os.pardir, os.pardir, camera + '.timestamps')
-  if not os.path.isfile(timestamps_path):
-      raise IOError("Could not find timestamps file")
+timestamps = TimestampIndex.from_sensor_dir(args.dir, camera)
 
 model = None
 if args.models_dir:
     model = CameraModel(args.models_dir, args.dir)
 
+filenames = []
 current_chunk = 0
-timestamps_file = open(timestamps_path)
-for line in timestamps_file:
-    tokens = line.split()
-    datetime = dt.utcfromtimestamp(int(tokens[0])/1000000)
-    chunk = int(tokens[1])
-
-    filename = os.path.join(args.dir, tokens[0] + '.png')
+for timestamp, chunk in zip(timestamps.timestamps.tolist(), timestamps.chunks.tolist()):
+    filename = os.path.join(args.dir, str(timestamp) + '.png')
     if not os.path.isfile(filename):
         if chunk != current_chunk:
             print("Chunk " + str(chunk) + " not found")
@@ -55,10 +52,31 @@ for line in timestamps_file:
         continue
 
     current_chunk = chunk
+    filenames.append(filename)
+
+artist = None
+
+
+def display(frame):
+    global artist
+    filename, img = frame
+    if artist is None:
+        artist = plt.imshow(img, cmap='gray', vmin=0, vmax=255)
+        plt.xticks([])
+        plt.yticks([])
+    else:
+        artist.set_data(img)
+    timestamp = int(os.path.basename(filename)[:-len('.png')])
+    plt.xlabel(dt.utcfromtimestamp(timestamp / 1000000))
+    plt.pause(0.001)
+
+
+# The undistortion maps are built once here rather than by every loader thread
+if model and filenames:
+    width, height = Image.open(filenames[0]).size
+    model.get_remap_tables(height, width)
 
-    img = load_image(filename, model)
-    plt.imshow(img)
-    plt.xlabel(datetime)
-    plt.xticks([])
-    plt.yticks([])
-    plt.pause(0.01)
+shown, dropped = play(PrefetchingFrameSource(filenames, lambda filename: load_image(filename, model), args.workers),
+                      display, args.fps)
+if dropped:
+    print("Dropped " + str(dropped) + " of " + str(shown + dropped) + " frames")
@@ -0,0 +1,75 @@
+import os
+import numpy as np
+from transform import build_se3_transforms
+from array_utils import load_cached_npy
+
+
+class PoseLog(object):
+    """Columnar view of a pose log (vo.csv or ins.csv).
+
+    The CSV is parsed once into a structured array, which is cached in `<log_path>.npy` and memory-mapped on later
+    loads. The cache is rebuilt if the CSV is newer, and kept in memory only if it cannot be written.
+
+    Attributes:
+        path (str): path to the CSV file.
+        timestamps (:obj: `numpy.ndarray`): int64 UNIX timestamp of each row (source timestamp for VO).
+        destination_timestamps (:obj: `numpy.ndarray`): int64 destination timestamp of each row, None for INS.
+        xyzrpys (:obj: `numpy.ndarray`): nx6 float64 array of translations and Euler angles (columns 2 to 7).
+
+    """
+
+    def __init__(self, log_path):
+        """Loads a pose log, parsing it only if it is not cached.
+
+        Args:
+            log_path (str): path to a vo.csv or ins.csv file.
+
+        Raises:
+            IOError: if the pose log does not exist.
+
+        """
+        if not os.path.isfile(log_path):
+            raise IOError('Could not find pose log ' + log_path)
+        self.path = log_path
+
+        rows = load_cached_npy(log_path + '.npy', log_path, lambda: self.__parse(log_path))
+
+        self.timestamps = rows['timestamp']
+        self.destination_timestamps = rows['destination_timestamp'] \
+            if 'destination_timestamp' in rows.dtype.names else None
+        self.xyzrpys = rows['xyzrpy']
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def se3_transforms(self, start=0, end=None):
+        """Builds the SE3 transforms of a range of rows.
+
+        Args:
+            start (int): first row.
+            end (int): (optional) row after the last one. Defaults to the end of the log.
+
+        Returns:
+            numpy.ndarray: nx4x4 array of SE3 homogeneous transformation matrices, see `build_se3_transforms`.
+
+        """
+        return build_se3_transforms(self.xyzrpys[start:end])
+
+    @staticmethod
+    def __parse(log_path):
+        with open(log_path) as log_file:
+            headers = next(log_file)
+            rows = [line.split(',') for line in log_file if line.strip()]
+
+        # VO logs have a destination timestamp in the second column, INS logs a status string
+        fields = [('timestamp', np.int64)]
+        if rows and rows[0][1].strip().isdigit():
+            fields.append(('destination_timestamp', np.int64))
+        fields.append(('xyzrpy', np.float64, (6,)))
+
+        log = np.empty(len(rows), dtype=fields)
+        log['timestamp'] = [int(row[0]) for row in rows]
+        if 'destination_timestamp' in log.dtype.names:
+            log['destination_timestamp'] = [int(row[1]) for row in rows]
+        log['xyzrpy'] = np.array([row[2:8] for row in rows], dtype=np.float64).reshape((-1, 6))
+        return log
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import subprocess
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 1
+OUTPUT_FILENAMES = ['images.npy', 'images.npz', 't.npz', 'labels.npz', 'images_shape.txt', 'transformations.txt']
+POINTS_FILENAME = 'points.npy'
+ADAPT_IMAGES_KITTI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'adapt_images_kitti.py')
+DEFAULT_VARIANT = 'default'
+
+
+# Example:
+# python preprocess_kitti.py ~/KITTI/ ~/train_images/ --sequences 00 01 02 --variants default mirror reverse,offset=2
+#                            --crop 500 375 --scale 128 96 --jobs 4
+# Expects the KITTI odometry layout: <kitti_dir>/sequences/<seq>/ and <kitti_dir>/poses/<seq>.txt
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Pre-process several KITTI sequences and variants with adapt_images_kitti')
+    parser.add_argument('kitti_dir', type=str, help='KITTI odometry root directory')
+    parser.add_argument('output_dir', type=str, help='Output directory. Each job writes into its own subdirectory')
+    parser.add_argument('--sequences', nargs='+', required=True, type=str, help='Sequences to process, e.g. 00 01')
+    parser.add_argument('--variants', nargs='+', default=[DEFAULT_VARIANT], type=str,
+                        help='Comma separated options of each variant: mirror, reverse, offset=N. '
+                             '"' + DEFAULT_VARIANT + '" means no option')
+    parser.add_argument('--crop', nargs=2, default=None, type=int, metavar=('WIDTH', 'HEIGHT'),
+                        help='(optional) If supplied, images will be cropped to WIDTH x HEIGHT')
+    parser.add_argument('--scale', nargs=2, default=None, type=int, metavar=('WIDTH', 'HEIGHT'),
+                        help='(optional) If supplied, images will be scaled to WIDTH x HEIGHT')
+    parser.add_argument('--resize_backend', type=str, default=None,
+                        help='(optional) Resize backend passed to adapt_images_kitti')
+    parser.add_argument('--reduced_decode', action='store_true',
+                        help='Decode the images at a reduced resolution. See adapt_images_kitti')
+    parser.add_argument('--points', action='store_true', help='Also triangulate points of the stereo pairs')
+    parser.add_argument('--matcher', type=str, default=None, help='(optional) Stereo matcher used with --points')
+    parser.add_argument('--seed', type=int, default=0, help='(optional) Base seed passed to adapt_images_kitti')
+    parser.add_argument('--jobs', type=int, default=1, help='(optional) Number of jobs run at the same time')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='(optional) Workers of each job. Defaults to the number of cores divided by --jobs')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='(optional) Frame cache directory shared by all the jobs. See adapt_images_kitti')
+    parser.add_argument('--force', action='store_true', help='Process every job, even if its output is up to date')
+    parser.add_argument('--dry_run', action='store_true', help='Only print the jobs that would be run')
+    args = parser.parse_args()
+    return args
+
+
+def parse_variant(variant):
+    options = {'mirror': False, 'reverse': False, 'offset': 1}
+    for token in variant.split(','):
+        token = token.strip()
+        if token in ('', DEFAULT_VARIANT):
+            continue
+        if token in ('mirror', 'reverse'):
+            options[token] = True
+        elif token.startswith('offset='):
+            options['offset'] = int(token[len('offset='):])
+        else:
+            raise ValueError('Unknown variant option: ' + token)
+    return options
+
+
+def get_job_name(sequence, options):
+    name = sequence
+    if options['mirror']:
+        name += '_mirror'
+    if options['reverse']:
+        name += '_reverse'
+    if options['offset'] != 1:
+        name += '_offset' + str(options['offset'])
+    return name
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+# Size and mtime of every file of a directory, reduced to a digest to keep the manifest small
+def directory_signature(path):
+    digest = hashlib.sha1()
+    filenames = sorted(os.listdir(path))
+    for filename in filenames:
+        digest.update(json.dumps([filename] + file_signature(os.path.join(path, filename))).encode('utf-8'))
+    return {'files': len(filenames), 'digest': digest.hexdigest()}
+
+
+def input_signature(sequence_dir, poses_file):
+    return {'calib': file_signature(os.path.join(sequence_dir, 'calib.txt')),
+            'poses': file_signature(poses_file),
+            'image_0': directory_signature(os.path.join(sequence_dir, 'image_0')),
+            'image_1': directory_signature(os.path.join(sequence_dir, 'image_1'))}
+
+
+# Build the adapt_images_kitti arguments of a (sequence, variant) job
+def build_job(args, sequence, options):
+    name = get_job_name(sequence, options)
+    sequence_dir = os.path.join(args.kitti_dir, 'sequences', sequence)
+    poses_file = os.path.join(args.kitti_dir, 'poses', sequence + '.txt')
+    output_dir = os.path.join(args.output_dir, name)
+    argv = [sequence_dir, poses_file, '--output_dir', output_dir, '--offset', str(options['offset']),
+            '--seed', str(args.seed)]
+    if args.crop:
+        argv += ['--crop'] + [str(x) for x in args.crop]
+    if args.scale:
+        argv += ['--scale'] + [str(x) for x in args.scale]
+    if args.resize_backend:
+        argv += ['--resize_backend', args.resize_backend]
+    if args.reduced_decode:
+        argv.append('--reduced_decode')
+    if options['mirror']:
+        argv.append('--mirror')
+    if options['reverse']:
+        argv.append('--reverse')
+    outputs = list(OUTPUT_FILENAMES)
+    if args.points:
+        argv.append('--points')
+        if args.matcher:
+            argv += ['--matcher', args.matcher]
+        outputs.append(POINTS_FILENAME)
+    return {'name': name, 'output_dir': output_dir, 'argv': argv, 'outputs': outputs,
+            'inputs': input_signature(sequence_dir, poses_file)}
+
+
+def load_manifest(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['jobs']
+
+
+def save_manifest(path, entries):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump({'version': MANIFEST_VERSION, 'jobs': entries}, manifest_file, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+# An output is up to date if it was produced with the same arguments from the same input files
+def is_up_to_date(entry, job):
+    if entry is None or entry['argv'] != job['argv'] or entry['inputs'] != job['inputs']:
+        return False
+    return all(os.path.isfile(os.path.join(job['output_dir'], filename)) for filename in job['outputs'])
+
+
+# Options that do not change the output, such as the number of workers, are not part of the job arguments
+def run_job(job, workers, cache_dir=None):
+    if not os.path.isdir(job['output_dir']):
+        os.makedirs(job['output_dir'])
+    command = [sys.executable, ADAPT_IMAGES_KITTI] + job['argv'] + ['--workers', str(workers)]
+    if cache_dir:
+        command += ['--cache_dir', cache_dir]
+    with open(os.path.join(job['output_dir'], 'log.txt'), 'w') as log_file:
+        return subprocess.call(command, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def main():
+    args = get_arguments()
+    if not os.path.isdir(args.output_dir):
+        raise IOError(args.output_dir + " is not an existing folder")
+    workers = args.workers
+    if workers is None:
+        workers = max(1, multiprocessing.cpu_count() // args.jobs)
+
+    manifest_path = os.path.join(args.output_dir, MANIFEST_FILENAME)
+    entries = load_manifest(manifest_path)
+
+    jobs = []
+    for sequence in args.sequences:
+        for variant in args.variants:
+            job = build_job(args, sequence, parse_variant(variant))
+            if not args.force and is_up_to_date(entries.get(job['name']), job):
+                print("Skipping " + job['name'] + " (up to date)")
+                continue
+            jobs.append(job)
+
+    print(str(len(jobs)) + " jobs to run")
+    if args.dry_run:
+        for job in jobs:
+            print(job['name'] + ": " + ' '.join(job['argv']))
+        return
+
+    # An entry is only recorded again once its job finishes successfully
+    for job in jobs:
+        entries.pop(job['name'], None)
+    save_manifest(manifest_path, entries)
+
+    lock = threading.Lock()
+
+    def process(job):
+        returncode = run_job(job, workers, args.cache_dir)
+        with lock:
+            if returncode == 0:
+                entries[job['name']] = {'argv': job['argv'], 'inputs': job['inputs']}
+                save_manifest(manifest_path, entries)
+        return job, returncode
+
+    failed = []
+    pool = ThreadPool(max(1, args.jobs))
+    for job, returncode in pool.imap_unordered(process, jobs):
+        if returncode == 0:
+            print("Done " + job['name'])
+        else:
+            print("Failed " + job['name'] + ", see " + os.path.join(job['output_dir'], 'log.txt'))
+            failed.append(job['name'])
+    pool.close()
+    pool.join()
+
+    if failed:
+        raise RuntimeError("Failed jobs: " + ', '.join(failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,69 +14,492 @@
 
 import os
 import re
+from collections import deque
 import numpy as np
-import matplotlib.pyplot as plt
 import argparse
+from PIL import Image
 
-from build_pointcloud import build_pointcloud
+from array_utils import NpyStreamWriter
+from build_pointcloud import build_pointcloud, iter_scans, DEFAULT_WORKERS
+from interpolate_poses import PoseSource
 from transform import build_se3_transform
-from image import load_image
+from image import load_image, save_image
 from camera_model import CameraModel
+from timestamp_index import TimestampIndex
+from scan_store import ScanStore, INDEX_DTYPE
+from worker_pool import imap_ordered, get_context
 
-parser = argparse.ArgumentParser(description='Project LIDAR data into camera image')
-parser.add_argument('--image_dir', type=str, help='Directory containing images')
-parser.add_argument('--laser_dir', type=str, help='Directory containing LIDAR scans')
-parser.add_argument('--poses_file', type=str, help='File containing either INS or VO poses')
-parser.add_argument('--models_dir', type=str, help='Directory containing camera models')
-parser.add_argument('--extrinsics_dir', type=str, help='Directory containing sensor extrinsics')
-parser.add_argument('--image_idx', type=int, help='Index of image to display')
+# (row, col, depth) of a pixel of a sparse depth map, see build_depth_maps
+SPARSE_DEPTH_DTYPE = [('row', np.uint16), ('col', np.uint16), ('depth', np.float32)]
 
-args = parser.parse_args()
 
-model = CameraModel(args.models_dir, args.image_dir)
+def get_camera_posesource_transform(model, extrinsics_dir, poses_type):
+    """Gets the transform from the frame of the pose source to the camera frame.
 
-extrinsics_path = os.path.join(args.extrinsics_dir, model.camera + '.txt')
-with open(extrinsics_path) as extrinsics_file:
-    extrinsics = [float(x) for x in next(extrinsics_file).split(' ')]
+    Args:
+        model (camera_model.CameraModel): camera model.
+        extrinsics_dir (str): directory containing sensor extrinsics.
+        poses_type (str): 'vo' or 'ins'.
 
-G_camera_vehicle = build_se3_transform(extrinsics)
-G_camera_posesource = None
+    Returns:
+        numpy.matrixlib.defmatrix.matrix: SE3 transform
 
-poses_type = re.search('(vo|ins)\.csv', args.poses_file).group(1)
-if poses_type == 'ins':
-    with open(os.path.join(args.extrinsics_dir, 'ins.txt')) as extrinsics_file:
-        extrinsics = next(extrinsics_file)
-        G_camera_posesource = G_camera_vehicle * build_se3_transform([float(x) for x in extrinsics.split(' ')])
-else:
+    """
+    extrinsics_path = os.path.join(extrinsics_dir, model.camera + '.txt')
+    with open(extrinsics_path) as extrinsics_file:
+        extrinsics = [float(x) for x in next(extrinsics_file).split(' ')]
+
+    G_camera_vehicle = build_se3_transform(extrinsics)
+
+    if poses_type == 'ins':
+        with open(os.path.join(extrinsics_dir, 'ins.txt')) as extrinsics_file:
+            extrinsics = next(extrinsics_file)
+            return G_camera_vehicle * build_se3_transform([float(x) for x in extrinsics.split(' ')])
     # VO frame and vehicle frame are the same
-    G_camera_posesource = G_camera_vehicle
+    return G_camera_vehicle
+
+
+def project_laser_into_camera(image_dir, laser_dir, poses, model, extrinsics_dir, timestamp, voxel_size=None,
+                              scan_store=None, G_camera_posesource=None):
+    """Loads an image and projects the LIDAR pointcloud of the 2 seconds around it into it, see `project_laser`.
+
+    Args:
+        image_dir (str): directory containing images.
+        laser_dir (str): directory containing LIDAR scans.
+        poses (str or interpolate_poses.PoseSource): file containing either INS or VO poses, or the poses already
+            loaded from it. Load them once with `PoseSource` to project many images.
+        model (camera_model.CameraModel): camera model.
+        extrinsics_dir (str): directory containing sensor extrinsics.
+        timestamp (int): UNIX timestamp of the image.
+        voxel_size (float): (optional) if supplied, keep one point per voxel of this size before projecting.
+        scan_store (str or scan_store.ScanStore): (optional) packed scans of laser_dir, see `build_pointcloud`.
+        G_camera_posesource (numpy.ndarray): (optional) transform from the pose source to the camera frame, see
+            `get_camera_posesource_transform`. Read from extrinsics_dir if not supplied.
+
+    Returns:
+        numpy.ndarray: the undistorted image.
+        numpy.ndarray: 2xm array of (u, v) pixel coordinates of the points that project into the image.
+        numpy.array: array of m depth values.
+
+    """
+    image = load_image(os.path.join(image_dir, str(timestamp) + '.png'), model)
+    uv, depth = project_laser(laser_dir, poses, model, extrinsics_dir, timestamp, image.shape, voxel_size, scan_store,
+                              G_camera_posesource)
+    return image, uv, depth
+
+
+def project_laser(laser_dir, poses, model, extrinsics_dir, timestamp, image_size, voxel_size=None, scan_store=None,
+                  G_camera_posesource=None, workers=DEFAULT_WORKERS):
+    """Projects the LIDAR pointcloud of the 2 seconds around an image into the camera, without loading the image.
+
+    Args:
+        laser_dir (str): directory containing LIDAR scans.
+        poses (str or interpolate_poses.PoseSource): file containing either INS or VO poses, or the poses already
+            loaded from it.
+        model (camera_model.CameraModel): camera model.
+        extrinsics_dir (str): directory containing sensor extrinsics.
+        timestamp (int): UNIX timestamp of the image.
+        image_size (tuple[int]): dimensions of the image in pixels.
+        voxel_size (float): (optional) see `project_laser_into_camera`.
+        scan_store (str or scan_store.ScanStore): (optional) see `project_laser_into_camera`.
+        G_camera_posesource (numpy.ndarray): (optional) see `project_laser_into_camera`.
+        workers (int): number of threads building the pointcloud, see `build_pointcloud`.
+
+    Returns:
+        numpy.ndarray: 2xm array of (u, v) pixel coordinates of the points that project into the image.
+        numpy.array: array of m depth values.
+
+    """
+    if G_camera_posesource is None:
+        if isinstance(poses, PoseSource):
+            poses_type = poses.type
+        else:
+            poses_type = re.search('(vo|ins)\.csv', poses).group(1)
+        G_camera_posesource = get_camera_posesource_transform(model, extrinsics_dir, poses_type)
+
+    pointcloud, reflectance = build_pointcloud(laser_dir, poses, extrinsics_dir,
+                                               timestamp - 1e7, timestamp + 1e7, timestamp, workers=workers,
+                                               scan_store=scan_store, voxel_size=voxel_size)
+
+    pointcloud = np.dot(G_camera_posesource, pointcloud)
+
+    return model.project(pointcloud, image_size)
+
+
+def depth_map(uv, depth, image_size):
+    """Rasterizes projected points into a sparse depth image, keeping the nearest point in each pixel.
+
+    Args:
+        uv (numpy.ndarray): 2xm array of (u, v) pixel coordinates, as returned by `CameraModel.project`.
+        depth (numpy.array): array of m depth values.
+        image_size (tuple[int]): dimensions of image in pixels.
+
+    Returns:
+        numpy.ndarray: float32 image of depths, 0 in pixels with no points.
+
+    """
+    # Pixel centres are at integer coordinates, starting from 1
+    cols = np.floor(np.ravel(uv[0, :]) + 0.5).astype(np.int64) - 1
+    rows = np.floor(np.ravel(uv[1, :]) + 0.5).astype(np.int64) - 1
+
+    image = np.full(tuple(image_size[0:2]), np.inf, dtype=np.float32)
+    np.minimum.at(image, (rows, cols), np.ravel(depth).astype(np.float32))
+    image[np.isinf(image)] = 0
+    return image
+
+
+def iter_depth_maps(laser_dir, poses, model, extrinsics_dir, image_timestamps, image_size, window=1e7,
+                    scan_store=None):
+    """Projects the LIDAR pointcloud around each image of a sequence into a depth map.
+
+    A sliding window of scans is kept over the sequence. Each scan is read and transformed once, when it enters the
+    window, and dropped when it leaves it, instead of building the pointcloud of every image from scratch.
+
+    Args:
+        laser_dir (str): directory containing LIDAR scans.
+        poses (str or interpolate_poses.PoseSource): file containing either INS or VO poses, or the poses already
+            loaded from it.
+        model (camera_model.CameraModel): camera model.
+        extrinsics_dir (str): directory containing sensor extrinsics.
+        image_timestamps (list[int]): UNIX timestamps of the images, in ascending order.
+        image_size (tuple[int]): dimensions of the images in pixels.
+        window (float): the pointcloud of an image holds the scans within this many microseconds of it.
+        scan_store (str or scan_store.ScanStore): (optional) packed scans of laser_dir, see `build_pointcloud`.
+
+    Yields:
+        int: UNIX timestamp of the image.
+        numpy.ndarray: float32 depth map of the image, see `depth_map`.
+
+    Raises:
+        ValueError: if image_timestamps is empty or not in ascending order.
+
+    """
+    image_timestamps = np.asarray(image_timestamps, dtype=np.int64)
+    if len(image_timestamps) == 0:
+        raise ValueError('No images to project into')
+    if np.any(image_timestamps[:-1] > image_timestamps[1:]):
+        raise ValueError('Image timestamps must be in ascending order')
+
+    if not isinstance(poses, PoseSource):
+        poses = PoseSource(poses)
+    G_camera_posesource = np.asarray(get_camera_posesource_transform(model, extrinsics_dir, poses.type))
+
+    # Scans are transformed to the frame of the first image, and from there to the frame of each image
+    origin_time = int(image_timestamps[0])
+    G_origin_posesource = poses.interpolate(image_timestamps, origin_time)
+    G_camera_origin = np.matmul(G_camera_posesource, np.linalg.inv(G_origin_posesource))
+
+    scans = iter_scans(laser_dir, poses, extrinsics_dir, image_timestamps[0] - window, image_timestamps[-1] + window,
+                       origin_time, scan_store)
+    next_scan = next(scans, None)
+    window_scans = deque()
+    for i, timestamp in enumerate(image_timestamps.tolist()):
+        while next_scan is not None and next_scan[0] <= timestamp + window:
+            window_scans.append(next_scan[0:2])
+            next_scan = next(scans, None)
+        while window_scans and window_scans[0][0] < timestamp - window:
+            window_scans.popleft()
+
+        if window_scans:
+            pointcloud = np.hstack([scan for _, scan in window_scans])
+            uv, depth = model.project_frames(pointcloud, G_camera_origin[i], image_size)[0]
+        else:
+            uv, depth = np.empty((2, 0)), np.empty(0)
+        yield timestamp, depth_map(uv, depth, image_size)
+
+
+def build_depth_maps(image_dir, laser_dir, poses, model, extrinsics_dir, output, start_idx=0, end_idx=None,
+                     window=1e7, scan_store=None, chunk_size=1000000):
+    """Writes the depth maps of a range of images as sparse (row, col, depth) triplets, see `iter_depth_maps`.
+
+    Writes `<output>.npy`, with the triplets of the pixels that have a depth (see `SPARSE_DEPTH_DTYPE`), image after
+    image, and `<output>_index.npy`, with the (timestamp, offset, count) of every image (see `scan_store.INDEX_DTYPE`).
+    Read them with `SparseDepthMaps`.
+
+    Args:
+        image_dir (str): directory containing images.
+        laser_dir (str): directory containing LIDAR scans.
+        poses (str or interpolate_poses.PoseSource): file containing either INS or VO poses.
+        model (camera_model.CameraModel): camera model.
+        extrinsics_dir (str): directory containing sensor extrinsics.
+        output (str): path of the output without extension.
+        start_idx (int): index of the first image.
+        end_idx (int): (optional) index after the last image. Defaults to the end of the sequence.
+        window (float): see `iter_depth_maps`.
+        scan_store (str or scan_store.ScanStore): (optional) packed scans of laser_dir.
+        chunk_size (int): number of triplets copied at a time into the output.
+
+    Returns:
+        str: name of the depth maps, output.
+
+    Raises:
+        ValueError: if the range doesn't contain any images.
+
+    """
+    image_timestamps = np.array(TimestampIndex.from_sensor_dir(image_dir, model.camera).timestamps[start_idx:end_idx])
+    if len(image_timestamps) == 0:
+        raise ValueError('No images in the given range')
+    image_size = load_image(os.path.join(image_dir, str(image_timestamps[0]) + '.png')).shape[0:2]
+
+    index = np.zeros(len(image_timestamps), dtype=INDEX_DTYPE)
+    index['timestamp'] = image_timestamps
+
+    # The number of triplets is only known at the end, so they are streamed to a raw file first
+    raw_path = output + '.tmp.bin'
+    with open(raw_path, 'wb') as raw_file:
+        for i, (_, image) in enumerate(iter_depth_maps(laser_dir, poses, model, extrinsics_dir, image_timestamps,
+                                                       image_size, window, scan_store)):
+            rows, cols = np.nonzero(image)
+            triplets = np.empty(len(rows), dtype=SPARSE_DEPTH_DTYPE)
+            triplets['row'] = rows
+            triplets['col'] = cols
+            triplets['depth'] = image[rows, cols]
+            triplets.tofile(raw_file)
+            index['count'][i] = len(triplets)
+    index['offset'][1:] = np.cumsum(index['count'])[:-1]
+
+    total = int(index['count'].sum())
+    with NpyStreamWriter(output, total, SPARSE_DEPTH_DTYPE, item_shape=()) as writer:
+        if total > 0:
+            raw = np.memmap(raw_path, dtype=SPARSE_DEPTH_DTYPE, mode='r')
+            for start in range(0, total, chunk_size):
+                writer.write(slice(start, start + chunk_size), raw[start:start + chunk_size])
+            del raw
+    os.remove(raw_path)
+
+    tmp_path = output + '_index.tmp.npy'
+    np.save(tmp_path, index)
+    os.rename(tmp_path, output + '_index.npy')
+    return output
+
+
+class SparseDepthMaps(object):
+    """Memory-mapped depth maps written by `build_depth_maps`.
+
+    Attributes:
+        name (str): path of the depth maps without extension.
+        index (:obj: `numpy.ndarray`): (timestamp, offset, count) of every image, sorted by timestamp.
+        triplets (:obj: `numpy.ndarray`): memory-mapped (row, col, depth) triplets of every image, see
+            `SPARSE_DEPTH_DTYPE`.
+
+    """
+
+    def __init__(self, name):
+        """Opens depth maps.
+
+        Args:
+            name (str): path of the depth maps without extension.
+
+        Raises:
+            IOError: if the depth maps do not exist.
+
+        """
+        if not os.path.isfile(name + '.npy') or not os.path.isfile(name + '_index.npy'):
+            raise IOError('Could not find depth maps ' + name)
+        self.name = name
+        self.index = np.load(name + '_index.npy', mmap_mode='r')
+        self.triplets = np.load(name + '.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def depth_map(self, i):
+        """Gets the pixels of image i that have a depth.
+
+        Returns:
+            numpy.array: array of m rows.
+            numpy.array: array of m columns.
+            numpy.array: array of m float32 depths.
+
+        """
+        triplets = self.triplets[self.index['offset'][i]:self.index['offset'][i] + self.index['count'][i]]
+        return triplets['row'], triplets['col'], triplets['depth']
+
+    def dense_depth_map(self, i, image_size):
+        """Gets the depth map of image i as a float32 image, 0 in pixels with no points."""
+        rows, cols, depths = self.depth_map(i)
+        image = np.zeros(tuple(image_size[0:2]), dtype=np.float32)
+        image[rows, cols] = depths
+        return image
+
+
+def render_overlay(image, uv, depth):
+    """Draws projected points over an image, coloured by depth with a jet colour map.
+
+    Args:
+        image (numpy.ndarray): greyscale or RGB uint8 image.
+        uv (numpy.ndarray): 2xm array of (u, v) pixel coordinates, as returned by `CameraModel.project`.
+        depth (numpy.array): array of m depth values.
+
+    Returns:
+        numpy.ndarray: RGB uint8 image. Nearer points are drawn over farther ones.
+
+    """
+    overlay = np.array(image, dtype=np.uint8)
+    if overlay.ndim == 2:
+        overlay = np.dstack((overlay, overlay, overlay))
+    depth = np.ravel(depth)
+    if len(depth) == 0:
+        return overlay
+
+    order = np.argsort(depth)[::-1]
+    cols = np.floor(np.ravel(uv[0, :])[order] + 0.5).astype(np.int64) - 1
+    rows = np.floor(np.ravel(uv[1, :])[order] + 0.5).astype(np.int64) - 1
+    span = depth.max() - depth.min()
+    x = (depth[order] - depth.min()) / span if span > 0 else np.zeros(len(depth))
+    colours = np.clip(1.5 - np.abs(4 * x[:, np.newaxis] - np.array([3, 2, 1])), 0, 1)
+    overlay[rows, cols, 0:3] = np.round(255 * colours).astype(np.uint8)
+    return overlay
+
+
+# Projects the LIDAR pointcloud into one image and writes the result to the output directory, see export_projections.
+# The camera model, extrinsics, poses and packed scans are loaded once per worker and kept in the context.
+# Input:
+#       job: (image index, image timestamp)
+# Output:
+#       (image index, number of projected points)
+def export_frame(job):
+    idx, timestamp = job
+    context = get_context()
+    if 'model' not in context:
+        context['model'] = CameraModel(context['models_dir'], context['image_dir'])
+    if 'poses' not in context:
+        context['poses'] = PoseSource(context['poses_file'])
+    if 'G_camera_posesource' not in context:
+        context['G_camera_posesource'] = get_camera_posesource_transform(context['model'], context['extrinsics_dir'],
+                                                                         context['poses'].type)
+    if context['scan_store'] is not None and not isinstance(context['scan_store'], ScanStore):
+        context['scan_store'] = ScanStore(context['scan_store'])
+
+    uv, depth = project_laser(context['laser_dir'], context['poses'], context['model'], context['extrinsics_dir'],
+                              timestamp, context['image_size'], context['voxel_size'], context['scan_store'],
+                              context['G_camera_posesource'], context['pointcloud_workers'])
+
+    name = os.path.join(context['output_dir'], str(timestamp))
+    if context['overlay']:
+        # Only overlays need the image itself
+        image = load_image(os.path.join(context['image_dir'], str(timestamp) + '.png'), context['model'])
+        save_image(render_overlay(image, uv, depth), name + '.png')
+    else:
+        tmp_path = name + '.tmp.npz'
+        np.savez(tmp_path, uv=np.asarray(uv), depth=depth)
+        os.rename(tmp_path, name + '.npz')
+    return idx, len(depth)
+
+
+def export_projections(image_dir, laser_dir, poses_file, models_dir, extrinsics_dir, output_dir, start_idx=0,
+                       end_idx=None, overlay=False, voxel_size=None, scan_store=None, workers=1):
+    """Projects the LIDAR pointcloud into a range of images, without displaying them.
+
+    For every image, writes `<output_dir>/<timestamp>.npz` with the `uv` and `depth` arrays returned by
+    `project_laser_into_camera`, or `<output_dir>/<timestamp>.png` with the points drawn over the image if overlay is
+    set. Images are spread over a pool of worker processes.
+
+    Args:
+        image_dir (str): directory containing images.
+        laser_dir (str): directory containing LIDAR scans.
+        poses_file (str): file containing either INS or VO poses.
+        models_dir (str): directory containing camera models.
+        extrinsics_dir (str): directory containing sensor extrinsics.
+        output_dir (str): directory the results are written to. Created if it does not exist.
+        start_idx (int): index of the first image.
+        end_idx (int): (optional) index after the last image. Defaults to the end of the sequence.
+        overlay (bool): write overlays instead of arrays, see `render_overlay`.
+        voxel_size (float): (optional) see `project_laser_into_camera`.
+        scan_store (str): (optional) packed scans of laser_dir, see `build_pointcloud`.
+        workers (int): number of worker processes. Images are processed in this process if it is 1 or less.
+
+    Returns:
+        int: number of images written.
+
+    Raises:
+        ValueError: if the range doesn't contain any images.
+
+    """
+    model = CameraModel(models_dir, image_dir)
+    timestamps = TimestampIndex.from_sensor_dir(image_dir, model.camera).timestamps[start_idx:end_idx].tolist()
+    if len(timestamps) == 0:
+        raise ValueError('No images in the given range')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # Builds the caches of the pose log and the LIDAR timestamps once, before the workers read them
+    poses = PoseSource(poses_file)
+    if scan_store is None:
+        lidar = re.search('(lms_front|lms_rear|ldmrs)', laser_dir).group(0)
+        TimestampIndex(os.path.join(laser_dir, os.pardir, lidar + '.timestamps'))
+
+    # Every image of a camera has the size of the first one, read from its header without decoding it
+    width, height = Image.open(os.path.join(image_dir, str(timestamps[0]) + '.png')).size
 
+    context = {'image_dir': image_dir, 'laser_dir': laser_dir, 'poses_file': poses_file, 'models_dir': models_dir,
+               'extrinsics_dir': extrinsics_dir, 'output_dir': output_dir, 'overlay': overlay,
+               'voxel_size': voxel_size, 'scan_store': scan_store, 'image_size': (height, width),
+               # Each worker process builds its pointclouds on one thread, so that the pool does not oversubscribe the
+               # cores. Serially, the pointclouds are built on the default number of threads
+               'pointcloud_workers': 1 if workers > 1 else DEFAULT_WORKERS}
+    if workers <= 1:
+        context['model'] = model
+        context['poses'] = poses
+    jobs = list(enumerate(timestamps))
+    for idx, _ in imap_ordered(export_frame, jobs, context, workers):
+        if (idx + 1) % 100 == 0:
+            print('%i/%i' % (idx + 1, len(jobs)))
+    return len(jobs)
 
-timestamps_path = os.path.join(args.image_dir, os.pardir, model.camera + '.timestamps')
-if not os.path.isfile(timestamps_path):
-    timestamps_path = os.path.join(args.image_dir, os.pardir, os.pardir, model.camera + '.timestamps')
 
-timestamp = 0
-with open(timestamps_path) as timestamps_file:
-    for i, line in enumerate(timestamps_file):
-        if i == args.image_idx:
-            timestamp = int(line.split(' ')[0])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Project LIDAR data into camera image')
+    parser.add_argument('--image_dir', type=str, help='Directory containing images')
+    parser.add_argument('--laser_dir', type=str, help='Directory containing LIDAR scans')
+    parser.add_argument('--poses_file', type=str, help='File containing either INS or VO poses')
+    parser.add_argument('--models_dir', type=str, help='Directory containing camera models')
+    parser.add_argument('--extrinsics_dir', type=str, help='Directory containing sensor extrinsics')
+    parser.add_argument('--image_idx', type=int, help='Index of image to display')
+    parser.add_argument('--voxel_size', type=float, default=None,
+                        help='(optional) If supplied, keep one point per voxel of this size (metres) before projecting')
+    parser.add_argument('--depth_maps', type=str, default=None,
+                        help='(optional) If supplied, write the sparse depth maps of images image_idx to end_idx to '
+                             '<depth_maps>.npy and <depth_maps>_index.npy instead of displaying an image')
+    parser.add_argument('--end_idx', type=int, default=None,
+                        help='(optional) Index after the last image written with --depth_maps or --export_dir. '
+                             'Defaults to the end')
+    parser.add_argument('--scan_store', type=str, default=None,
+                        help='(optional) Packed scans of laser_dir, written by scan_store.py')
+    parser.add_argument('--export_dir', type=str, default=None,
+                        help='(optional) If supplied, write the projections of images image_idx to end_idx to this '
+                             'directory instead of displaying an image')
+    parser.add_argument('--overlay', action='store_true',
+                        help='(optional) With --export_dir, write the points drawn over the images instead of arrays')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='(optional) Number of worker processes used with --export_dir')
 
-pointcloud, reflectance = build_pointcloud(args.laser_dir, args.poses_file, args.extrinsics_dir,
-                                           timestamp - 1e7, timestamp + 1e7, timestamp)
+    args = parser.parse_args()
 
-pointcloud = np.dot(G_camera_posesource, pointcloud)
+    if args.export_dir:
+        count = export_projections(args.image_dir, args.laser_dir, args.poses_file, args.models_dir,
+                                   args.extrinsics_dir, args.export_dir, args.image_idx or 0, args.end_idx,
+                                   args.overlay, args.voxel_size, args.scan_store, args.workers)
+        print('Wrote %i projections to %s' % (count, args.export_dir))
+    elif args.depth_maps:
+        model = CameraModel(args.models_dir, args.image_dir)
+        path = build_depth_maps(args.image_dir, args.laser_dir, args.poses_file, model, args.extrinsics_dir,
+                                args.depth_maps, args.image_idx or 0, args.end_idx, scan_store=args.scan_store)
+        print('Wrote depth maps to ' + path + '.npy')
+    else:
+        import matplotlib.pyplot as plt
 
-image_path = os.path.join(args.image_dir, str(timestamp) + '.png')
-image = load_image(image_path, model)
+        model = CameraModel(args.models_dir, args.image_dir)
+        timestamp = int(TimestampIndex.from_sensor_dir(args.image_dir, model.camera)[args.image_idx])
 
-uv, depth = model.project(pointcloud, image.shape)
+        image, uv, depth = project_laser_into_camera(args.image_dir, args.laser_dir, args.poses_file, model,
+                                                     args.extrinsics_dir, timestamp, args.voxel_size, args.scan_store)
 
-plt.imshow(image)
-plt.hold(True)
-plt.scatter(np.ravel(uv[0, :]), np.ravel(uv[1, :]), s=2, c=depth, edgecolors='none', cmap='jet')
-plt.xlim(0, image.shape[1])
-plt.ylim(image.shape[0], 0)
-plt.xticks([])
-plt.yticks([])
-plt.show()
+        plt.imshow(image)
+        plt.hold(True)
+        plt.scatter(np.ravel(uv[0, :]), np.ravel(uv[1, :]), s=2, c=depth, edgecolors='none', cmap='jet')
+        plt.xlim(0, image.shape[1])
+        plt.ylim(image.shape[0], 0)
+        plt.xticks([])
+        plt.yticks([])
+        plt.show()
@@ -0,0 +1,133 @@
+import os
+import re
+import numpy as np
+from array_utils import NpyStreamWriter
+from timestamp_index import TimestampIndex
+
+INDEX_DTYPE = [('timestamp', np.int64), ('offset', np.int64), ('count', np.int64)]
+
+
+def get_store_name(lidar_dir):
+    """Gets the default name of the packed store of a LIDAR directory, next to its timestamps file.
+
+    Returns:
+        str: `<lidar_dir>/../<lidar>_scans`, without extension.
+
+    """
+    lidar = re.search('(lms_front|lms_rear|ldmrs)', lidar_dir).group(0)
+    return os.path.join(lidar_dir, os.pardir, lidar + '_scans')
+
+
+def pack_scans(lidar_dir, name=None, flush_every=1024):
+    """Packs all the scans of a LIDAR directory into one contiguous float64 array.
+
+    Writes `<name>.npy`, an nx3 array with the points of every scan in timestamp order, and `<name>_index.npy`, with the
+    (timestamp, offset, count) of every timestamp in the timestamps file. Offsets and counts are in points, and the
+    count is 0 for scans whose file is missing.
+
+    Args:
+        lidar_dir (str): directory containing LIDAR scans.
+        name (str): (optional) path of the store without extension, see `get_store_name`.
+        flush_every (int): number of scans written between flushes.
+
+    Returns:
+        str: name of the store.
+
+    Raises:
+        IOError: if no scan files are found.
+
+    """
+    if name is None:
+        name = get_store_name(lidar_dir)
+    lidar = re.search('(lms_front|lms_rear|ldmrs)', lidar_dir).group(0)
+    timestamps = TimestampIndex(os.path.join(lidar_dir, os.pardir, lidar + '.timestamps')).timestamps
+
+    scan_paths = [os.path.join(lidar_dir, str(timestamp) + '.bin') for timestamp in timestamps.tolist()]
+    index = np.zeros(len(scan_paths), dtype=INDEX_DTYPE)
+    index['timestamp'] = timestamps
+    index['count'] = [os.path.getsize(path) // (3 * 8) if os.path.isfile(path) else 0 for path in scan_paths]
+    index['offset'][1:] = np.cumsum(index['count'])[:-1]
+    if index['count'].sum() == 0:
+        raise IOError('Could not find scan files in directory ' + lidar_dir)
+
+    with NpyStreamWriter(name, int(index['count'].sum()), np.float64, item_shape=(3,),
+                         flush_every=flush_every) as writer:
+        for path, offset, count in zip(scan_paths, index['offset'], index['count']):
+            if count > 0:
+                writer.write(slice(offset, offset + count), np.fromfile(path, np.double).reshape((count, 3)))
+
+    tmp_path = name + '_index.tmp.npy'
+    np.save(tmp_path, index)
+    os.rename(tmp_path, name + '_index.npy')
+    return name
+
+
+class ScanStore(object):
+    """Memory-mapped store of packed LIDAR scans, see `pack_scans`.
+
+    Attributes:
+        name (str): path of the store without extension.
+        index (:obj: `numpy.ndarray`): (timestamp, offset, count) of every scan, sorted by timestamp.
+        points (:obj: `numpy.ndarray`): memory-mapped nx3 array of the points of every scan.
+
+    """
+
+    def __init__(self, name):
+        """Opens a packed store.
+
+        Args:
+            name (str): path of the store without extension.
+
+        Raises:
+            IOError: if the store does not exist.
+
+        """
+        if not os.path.isfile(name + '.npy') or not os.path.isfile(name + '_index.npy'):
+            raise IOError('Could not find packed scans ' + name)
+        self.name = name
+        self.index = np.load(name + '_index.npy', mmap_mode='r')
+        self.points = np.load(name + '.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def window_slice(self, start_time, end_time):
+        """Gets the indices of the scans in a time window, as a slice."""
+        start = np.searchsorted(self.index['timestamp'], start_time, side='left')
+        end = np.searchsorted(self.index['timestamp'], end_time, side='right')
+        return slice(int(start), int(max(start, end)))
+
+    def window(self, start_time, end_time):
+        """Gets the scans in a time window.
+
+        Args:
+            start_time (int): UNIX timestamp of the start of the window.
+            end_time (int): UNIX timestamp of the end of the window.
+
+        Returns:
+            numpy.ndarray: index entries of the scans, including those with no points.
+            numpy.ndarray: memory-mapped mx3 slice of the points of those scans, without copying them.
+
+        """
+        entries = self.index[self.window_slice(start_time, end_time)]
+        if len(entries) == 0:
+            return entries, self.points[0:0]
+        return entries, self.points[entries['offset'][0]:entries['offset'][-1] + entries['count'][-1]]
+
+    def scan(self, i):
+        """Gets the points of a scan as a memory-mapped nx3 slice."""
+        return self.points[self.index['offset'][i]:self.index['offset'][i] + self.index['count'][i]]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pack the LIDAR scans of a directory into one file')
+    parser.add_argument('laser_dir', type=str, help='Directory containing LIDAR data')
+    parser.add_argument('--output', type=str, default=None,
+                        help='(optional) Path of the store without extension. <laser_dir>/../<lidar>_scans by default')
+    args = parser.parse_args()
+
+    name = pack_scans(args.laser_dir, args.output)
+    store = ScanStore(name)
+    print('Packed %i scans, %i points into %s.npy' % (len(store), len(store.points), name))
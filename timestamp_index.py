@@ -0,0 +1,120 @@
+import os
+import numpy as np
+from array_utils import load_cached_npy
+
+
+class TimestampIndex(object):
+    """Sorted, memory-mapped index of a sensor's timestamps file.
+
+    The timestamps file is parsed once into a (2, n) int64 array of timestamps and chunk numbers, which is cached in
+    `<timestamps_path>.npy` and memory-mapped on later loads. The cache is rebuilt if the timestamps file is newer, and
+    kept in memory only if it cannot be written.
+
+    Attributes:
+        path (str): path to the timestamps file.
+        timestamps (:obj: `numpy.ndarray`): sorted int64 UNIX timestamps, in microseconds.
+        chunks (:obj: `numpy.ndarray`): int64 chunk number of each timestamp.
+
+    """
+
+    def __init__(self, timestamps_path):
+        """Loads a timestamps file, parsing it only if it is not cached.
+
+        Args:
+            timestamps_path (str): path to a `*.timestamps` file.
+
+        Raises:
+            IOError: if the timestamps file does not exist.
+
+        """
+        if not os.path.isfile(timestamps_path):
+            raise IOError('Could not find timestamps file ' + timestamps_path)
+        self.path = timestamps_path
+
+        index = load_cached_npy(timestamps_path + '.npy', timestamps_path, lambda: self.__parse(timestamps_path))
+
+        self.timestamps = index[0]
+        self.chunks = index[1]
+
+    @classmethod
+    def from_sensor_dir(cls, data_dir, sensor):
+        """Finds the timestamps file of a sensor next to its data directory.
+
+        Args:
+            data_dir (str): directory containing the sensor data, e.g. `.../stereo/centre` or `.../lms_front`.
+            sensor (str): name of the sensor, e.g. `stereo` or `lms_front`.
+
+        Returns:
+            TimestampIndex: index of `<sensor>.timestamps`, in the parent or grandparent directory of data_dir.
+
+        Raises:
+            IOError: if the timestamps file is not found.
+
+        """
+        for parent in (os.pardir, os.path.join(os.pardir, os.pardir)):
+            timestamps_path = os.path.join(data_dir, parent, sensor + '.timestamps')
+            if os.path.isfile(timestamps_path):
+                return cls(timestamps_path)
+        raise IOError('Could not find timestamps file for ' + sensor + ' in ' + data_dir)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, idx):
+        return self.timestamps[idx]
+
+    def window(self, start_time, end_time):
+        """Gets the timestamps in a time window.
+
+        Args:
+            start_time (int): UNIX timestamp of the start of the window.
+            end_time (int): UNIX timestamp of the end of the window.
+
+        Returns:
+            numpy.ndarray: timestamps t such that start_time <= t <= end_time.
+
+        """
+        return self.timestamps[self.window_slice(start_time, end_time)]
+
+    def window_slice(self, start_time, end_time):
+        """Gets the indices of the timestamps in a time window, as a slice."""
+        start = np.searchsorted(self.timestamps, start_time, side='left')
+        end = np.searchsorted(self.timestamps, end_time, side='right')
+        return slice(int(start), int(max(start, end)))
+
+    def nearest(self, timestamp):
+        """Gets the index of the timestamp closest to a given time.
+
+        Args:
+            timestamp (int): UNIX timestamp.
+
+        Returns:
+            int: index of the nearest timestamp. Ties go to the earlier one.
+
+        Raises:
+            ValueError: if the index is empty.
+
+        """
+        if len(self.timestamps) == 0:
+            raise ValueError('No timestamps in ' + self.path)
+        idx = int(np.searchsorted(self.timestamps, timestamp))
+        if idx == len(self.timestamps):
+            return idx - 1
+        if idx > 0 and timestamp - self.timestamps[idx - 1] <= self.timestamps[idx] - timestamp:
+            return idx - 1
+        return idx
+
+    @staticmethod
+    def __parse(timestamps_path):
+        timestamps = []
+        chunks = []
+        with open(timestamps_path) as timestamps_file:
+            for line in timestamps_file:
+                tokens = line.split()
+                if not tokens:
+                    continue
+                timestamps.append(int(tokens[0]))
+                chunks.append(int(tokens[1]) if len(tokens) > 1 else 0)
+        index = np.array([timestamps, chunks], dtype=np.int64).reshape((2, -1))
+        order = np.argsort(index[0], kind='mergesort')
+        return index[:, order]
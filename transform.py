@@ -186,3 +186,190 @@ def se3_to_components(se3):
     xyzrpy[0:3] = se3[0:3, 3].transpose()
     xyzrpy[3:6] = so3_to_euler(se3[0:3, 0:3])
     return xyzrpy
+
+
+def se3_to_homogeneous(se3s):
+    """Converts a stack of 3x4 transforms to 4x4 homogeneous transforms.
+
+    Args:
+        se3s (numpy.ndarray): nx3x4 or nx12 array of [R | t] transforms.
+
+    Returns:
+        numpy.ndarray: nx4x4 array of SE3 homogeneous transformation matrices
+
+    """
+    se3s = np.asarray(se3s, dtype=np.float64).reshape((-1, 3, 4))
+    homogeneous = np.zeros((se3s.shape[0], 4, 4))
+    homogeneous[:, 0:3, :] = se3s
+    homogeneous[:, 3, 3] = 1
+    return homogeneous
+
+
+def invert_se3_transforms(se3s):
+    """Inverts a stack of SE3 transforms in closed form, i.e. [R | t]^-1 = [R^T | -R^T t].
+
+    Args:
+        se3s (numpy.ndarray): nx4x4 array of SE3 homogeneous transformation matrices.
+
+    Returns:
+        numpy.ndarray: nx4x4 array of inverted transforms
+
+    """
+    se3s = np.asarray(se3s)
+    rotations_t = np.transpose(se3s[:, 0:3, 0:3], (0, 2, 1))
+    inverse = np.zeros(se3s.shape)
+    inverse[:, 0:3, 0:3] = rotations_t
+    inverse[:, 0:3, 3] = -np.einsum('nij,nj->ni', rotations_t, se3s[:, 0:3, 3])
+    inverse[:, 3, 3] = 1
+    return inverse
+
+
+def quaternions_from_matrices(matrices):
+    """Converts a stack of rotation matrices to quaternions.
+
+    Batched version of `transformations.quaternion_from_matrix` (with isprecise=False), which gives the same result
+    for every matrix.
+
+    Args:
+        matrices (numpy.ndarray): nx3x3, nx3x4 or nx4x4 array. Only the upper left 3x3 block is used.
+
+    Returns:
+        numpy.ndarray: nx4 array of quaternions [w, x, y, z], with w >= 0
+
+    """
+    M = np.asarray(matrices, dtype=np.float64)
+    m00, m01, m02 = M[:, 0, 0], M[:, 0, 1], M[:, 0, 2]
+    m10, m11, m12 = M[:, 1, 0], M[:, 1, 1], M[:, 1, 2]
+    m20, m21, m22 = M[:, 2, 0], M[:, 2, 1], M[:, 2, 2]
+    # Symmetric matrices K (only the lower triangle is used by eigh)
+    K = np.zeros((M.shape[0], 4, 4))
+    K[:, 0, 0] = m00 - m11 - m22
+    K[:, 1, 0] = m01 + m10
+    K[:, 1, 1] = m11 - m00 - m22
+    K[:, 2, 0] = m02 + m20
+    K[:, 2, 1] = m12 + m21
+    K[:, 2, 2] = m22 - m00 - m11
+    K[:, 3, 0] = m21 - m12
+    K[:, 3, 1] = m02 - m20
+    K[:, 3, 2] = m10 - m01
+    K[:, 3, 3] = m00 + m11 + m22
+    K /= 3.0
+    # Each quaternion is the eigenvector of K that corresponds to the largest eigenvalue
+    w, V = np.linalg.eigh(K)
+    q = V[np.arange(M.shape[0]), :, np.argmax(w, axis=1)][:, [3, 0, 1, 2]]
+    q[q[:, 0] < 0.0] *= -1
+    return q
+
+
+def se3_to_xyzquaternion(se3s):
+    """Converts a stack of SE3 transforms to translations and quaternions.
+
+    Args:
+        se3s (numpy.ndarray): nx3x4 or nx4x4 array of SE3 transforms.
+
+    Returns:
+        numpy.ndarray: nx7 array of [x, y, z, qw, qx, qy, qz]
+
+    """
+    se3s = np.asarray(se3s, dtype=np.float64)
+    xyzq = np.empty((se3s.shape[0], 7))
+    xyzq[:, 0:3] = se3s[:, 0:3, 3]
+    xyzq[:, 3:7] = quaternions_from_matrices(se3s)
+    return xyzq
+
+
+def build_se3_transforms(xyzrpys):
+    """Creates a stack of SE3 transforms from translations and Euler angles.
+
+    Batched version of `build_se3_transform`.
+
+    Args:
+        xyzrpys (numpy.ndarray): nx6 array of translations and Euler angles (x, y, z, roll, pitch, yaw).
+
+    Returns:
+        numpy.ndarray: nx4x4 array of SE3 homogeneous transformation matrices
+
+    Raises:
+        ValueError: if xyzrpys does not have six columns
+
+    """
+    xyzrpys = np.asarray(xyzrpys, dtype=np.float64).reshape((-1, np.shape(xyzrpys)[-1]))
+    if xyzrpys.shape[1] != 6:
+        raise ValueError("Must supply 6 values to build each transform")
+
+    cr, cp, cy = np.cos(xyzrpys[:, 3]), np.cos(xyzrpys[:, 4]), np.cos(xyzrpys[:, 5])
+    sr, sp, sy = np.sin(xyzrpys[:, 3]), np.sin(xyzrpys[:, 4]), np.sin(xyzrpys[:, 5])
+
+    # R_zyx = R_z * R_y * R_x
+    se3s = np.zeros((xyzrpys.shape[0], 4, 4))
+    se3s[:, 0, 0] = cy * cp
+    se3s[:, 0, 1] = cy * sp * sr - sy * cr
+    se3s[:, 0, 2] = cy * sp * cr + sy * sr
+    se3s[:, 1, 0] = sy * cp
+    se3s[:, 1, 1] = sy * sp * sr + cy * cr
+    se3s[:, 1, 2] = sy * sp * cr - cy * sr
+    se3s[:, 2, 0] = -sp
+    se3s[:, 2, 1] = cp * sr
+    se3s[:, 2, 2] = cp * cr
+    se3s[:, 0:3, 3] = xyzrpys[:, 0:3]
+    se3s[:, 3, 3] = 1
+    return se3s
+
+
+def so3_to_quaternions(so3s):
+    """Converts a stack of SO3 rotation matrices to quaternions.
+
+    Batched version of `so3_to_quaternion`, which gives the same result for every matrix.
+
+    Args:
+        so3s (numpy.ndarray): nx3x3 array of rotation matrices.
+
+    Returns:
+        numpy.ndarray: nx4 array of quaternions [w, x, y, z]
+
+    Raises:
+        ValueError: if so3s is not nx3x3
+
+    """
+    R = np.asarray(so3s, dtype=np.float64)
+    if R.ndim != 3 or R.shape[1:] != (3, 3):
+        raise ValueError("SO3 matrices must be 3x3")
+
+    R_xx, R_xy, R_xz = R[:, 0, 0], R[:, 0, 1], R[:, 0, 2]
+    R_yx, R_yy, R_yz = R[:, 1, 0], R[:, 1, 1], R[:, 1, 2]
+    R_zx, R_zy, R_zz = R[:, 2, 0], R[:, 2, 1], R[:, 2, 2]
+
+    # w is 0 where it would be non-real
+    w = np.sqrt(np.maximum(R_xx + R_yy + R_zz + 1, 0)) / 2
+    x = np.sqrt(np.maximum(1 + R_xx - R_yy - R_zz, 0)) / 2
+    y = np.sqrt(np.maximum(1 + R_yy - R_xx - R_zz, 0)) / 2
+    z = np.sqrt(np.maximum(1 + R_zz - R_yy - R_xx, 0)) / 2
+
+    max_index = np.argmax(np.stack((w, x, y, z), axis=1), axis=1)
+    quaternions = np.empty((R.shape[0], 4))
+
+    i = max_index == 0
+    quaternions[i, 0] = w[i]
+    quaternions[i, 1] = (R_zy[i] - R_yz[i]) / (4 * w[i])
+    quaternions[i, 2] = (R_xz[i] - R_zx[i]) / (4 * w[i])
+    quaternions[i, 3] = (R_yx[i] - R_xy[i]) / (4 * w[i])
+
+    i = max_index == 1
+    quaternions[i, 0] = (R_zy[i] - R_yz[i]) / (4 * x[i])
+    quaternions[i, 1] = x[i]
+    quaternions[i, 2] = (R_xy[i] + R_yx[i]) / (4 * x[i])
+    quaternions[i, 3] = (R_zx[i] + R_xz[i]) / (4 * x[i])
+
+    i = max_index == 2
+    quaternions[i, 0] = (R_xz[i] - R_zx[i]) / (4 * y[i])
+    quaternions[i, 1] = (R_xy[i] + R_yx[i]) / (4 * y[i])
+    quaternions[i, 2] = y[i]
+    quaternions[i, 3] = (R_yz[i] + R_zy[i]) / (4 * y[i])
+
+    i = max_index == 3
+    quaternions[i, 0] = (R_yx[i] - R_xy[i]) / (4 * z[i])
+    quaternions[i, 1] = (R_zx[i] + R_xz[i]) / (4 * z[i])
+    quaternions[i, 2] = (R_yz[i] + R_zy[i]) / (4 * z[i])
+    quaternions[i, 3] = z[i]
+
+    return quaternions
@@ -1,4 +1,5 @@
 import cv2
+import time
 import numpy as np
 from matplotlib import pyplot as plt
 
@@ -59,6 +60,69 @@ def matcher(img1, img2):
     return pts1, pts2
 
 
+# Matcher for rectified stereo images. Matches ORB keypoints only along the same scanline and with a disparity in
+# [0, max_disparity], instead of matching against the whole image and estimating the fundamental matrix.
+# Input: stereo images (rectified)
+#        row_tolerance -> maximum difference between the rows of matched points (pixels)
+#        max_disparity -> maximum difference between the columns of matched points (pixels)
+#        max_distance -> maximum Hamming distance between matched descriptors
+# Output: pts1 -> 2xN array of points from left image
+#         pts2 -> 2xN array of points from right image
+def rectified_matcher(img1, img2, row_tolerance=1, max_disparity=256, max_distance=64, max_features=3000):
+    orb = cv2.ORB_create(nfeatures=max_features)
+    kp1, des1 = orb.detectAndCompute(img1, None)
+    kp2, des2 = orb.detectAndCompute(img2, None)
+    if des1 is None or des2 is None:
+        return np.empty((2, 0), np.float32), np.empty((2, 0), np.float32)
+
+    xy1 = np.int32([kp.pt for kp in kp1])
+    xy2 = np.int32([kp.pt for kp in kp2])
+    # Only pairs on the same scanline with a non-negative disparity are candidates
+    row_difference = np.abs(xy1[:, 1, np.newaxis] - xy2[np.newaxis, :, 1])
+    disparity = xy1[:, 0, np.newaxis] - xy2[np.newaxis, :, 0]
+    candidates = (row_difference <= row_tolerance) & (disparity >= 0) & (disparity <= max_disparity)
+    candidates = candidates.astype(np.uint8)
+
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING)
+    matches12 = bf.match(des1, des2, candidates)
+    matches21 = bf.match(des2, des1, np.ascontiguousarray(candidates.T))
+    best21 = dict((m.queryIdx, m.trainIdx) for m in matches21)
+    # Cross check
+    good = [m for m in matches12 if m.distance <= max_distance and best21.get(m.trainIdx) == m.queryIdx]
+
+    pts1 = np.float32([xy1[m.queryIdx] for m in good]).reshape(-1, 2).transpose()
+    pts2 = np.float32([xy2[m.trainIdx] for m in good]).reshape(-1, 2).transpose()
+    return pts1, pts2
+
+
+MATCHERS = {'sift': matcher, 'orb': rectified_matcher}
+DEFAULT_MATCHER = 'sift'
+
+
+def get_matcher(name):
+    if name not in MATCHERS:
+        raise ValueError('Unknown matcher: ' + name + '. Available matchers: ' + ', '.join(sorted(MATCHERS)))
+    return MATCHERS[name]
+
+
+# Time each matcher over a list of stereo pairs
+# Output: dict name -> (seconds per pair, mean number of matches per pair)
+def benchmark_matchers(left_images, right_images, names=None):
+    if names is None:
+        names = sorted(MATCHERS)
+    results = {}
+    for name in names:
+        match = get_matcher(name)
+        num_matches = 0
+        start = time.time()
+        for img1, img2 in zip(left_images, right_images):
+            pts1, pts2 = match(img1, img2)
+            num_matches += pts1.shape[1]
+        elapsed = time.time() - start
+        results[name] = (elapsed / len(left_images), float(num_matches) / len(left_images))
+    return results
+
+
 # Input: P1 -> projection matrix
 #        P2 -> projection matrix
 #        x1 -> 2xN array of points
@@ -89,3 +153,24 @@ def triangulatePoints(P1, P2, x1, x2):
 #                  [-1.822835e-10, 9.999999e-01, -5.072855e-10, -3.330669e-16],
 #                  [5.241111e-10, -5.072855e-10, 9.999999e-01, 2.220446e-16],
 #                  [0.,0.,0.,1.]])
+
+
+# Example:
+# python triangulate.py ~/KITTI/sequences/00 --frames 50
+if __name__ == "__main__":
+    import os
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare the stereo matchers on a KITTI sequence')
+    parser.add_argument('dir', type=str, help='Directory containing image sequence (image_0 and image_1)')
+    parser.add_argument('--frames', type=int, default=50, help='Number of stereo pairs')
+    parser.add_argument('--matchers', nargs='+', default=sorted(MATCHERS), choices=sorted(MATCHERS))
+    args = parser.parse_args()
+
+    filenames = sorted(os.listdir(os.path.join(args.dir, 'image_0')))[:args.frames]
+    left_images = [cv2.imread(os.path.join(args.dir, 'image_0', f), cv2.IMREAD_GRAYSCALE) for f in filenames]
+    right_images = [cv2.imread(os.path.join(args.dir, 'image_1', f), cv2.IMREAD_GRAYSCALE) for f in filenames]
+    results = benchmark_matchers(left_images, right_images, args.matchers)
+    for name in args.matchers:
+        seconds, num_matches = results[name]
+        print('%s: %.1f ms per pair, %.1f matches per pair' % (name, seconds * 1000, num_matches))
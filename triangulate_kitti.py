@@ -0,0 +1,231 @@
+import os
+import argparse
+import numpy as np
+from image import non_demosaic_load
+from array_utils import NpyStreamWriter
+from triangulate import triangulatePoints, get_matcher, MATCHERS, DEFAULT_MATCHER
+from outliers import mask_outliers
+from frame_cache import FrameCache
+from worker_pool import imap_ordered, get_context
+
+
+_CAM2INDEX = {'cam0': 0, 'cam1': 1, 'cam2': 2, 'cam3': 3}
+_CAM2FOLDER = {'cam0': 'image_0', 'cam1': 'image_1', 'cam2': 'image_2', 'cam3': 'image_3'}
+DEFAULT_CALIBRATION_FILENAME = 'calib.txt'
+DEFAULT_NUM_POINTS = 25
+POINTS_FILENAME = 'points'
+
+
+# Triangulates N points of every stereo pair of a KITTI sequence and saves them in <output_dir>/points.npy
+# Example:
+# python triangulate_kitti.py ~/KITTI/sequences/00 --output_dir ~/train_images/00 --workers 8
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Triangulate points of a KITTI stereo sequence')
+    parser.add_argument('dir', type=str, help='Directory containing image sequence')
+    parser.add_argument('--output_dir', type=str, default=None, help='(optional) Output directory')
+    parser.add_argument('--num_points', type=int, default=DEFAULT_NUM_POINTS,
+                        help='(optional) Number of points selected in each frame')
+    parser.add_argument('--matcher', type=str, default=DEFAULT_MATCHER, choices=sorted(MATCHERS),
+                        help='(optional) Stereo matcher. "orb" only searches along the scanlines of the rectified '
+                             'images. Run triangulate.py to compare them')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='(optional) Number of processes used to process the frames')
+    parser.add_argument('--flush_every', type=int, default=256,
+                        help='(optional) Flush the output array to disk every n frames')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='(optional) Directory of the points cache. Runs with the same images, calibration, '
+                             'seed and number of points reuse the cached points')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='(optional) Base seed. Frame i uses seed + i to select its triangulated points')
+    args = parser.parse_args()
+    return args
+
+
+def get_calibration_matrix(calibration, cam):
+    idx = _CAM2INDEX[cam]
+    calibration_matrix = calibration[idx, 1:]
+    return np.asmatrix(calibration_matrix.reshape(3, 4))
+
+
+def get_image_folder_name(cam):
+    return _CAM2FOLDER[cam]
+
+
+def get_calibration_path(sequence_dir):
+    return os.path.join(sequence_dir, DEFAULT_CALIBRATION_FILENAME)
+
+
+def load_calibration(sequence_dir):
+    with open(get_calibration_path(sequence_dir)) as calibration_file:
+        calib = np.genfromtxt(calibration_file, delimiter=' ')
+    return get_calibration_matrix(calib, "cam0"), get_calibration_matrix(calib, "cam1")
+
+
+def list_image_paths(sequence_dir, cam):
+    image_dir = os.path.join(sequence_dir, get_image_folder_name(cam))
+    image_filenames = sorted(
+        [item for item in os.listdir(image_dir) if os.path.isfile(os.path.join(image_dir, item))])
+    return [os.path.join(image_dir, item) for item in image_filenames]
+
+
+def list_stereo_pairs(sequence_dir):
+    left_image_paths = list_image_paths(sequence_dir, "cam0")
+    right_image_paths = list_image_paths(sequence_dir, "cam1")
+    for left_image_path, right_image_path in zip(left_image_paths, right_image_paths):
+        assert os.path.basename(left_image_path) == os.path.basename(right_image_path)
+    return left_image_paths, right_image_paths
+
+
+def get_frame_seed(seed, frame_idx):
+    return (seed + frame_idx) % (2 ** 32)
+
+
+# Mask points near the center of the image
+# Input:
+#       x1 -> 3xN array of 2D coordinates (image plane coordinates)
+# Output:
+#       center_crop_mask -> 1D array of N bool values (shape = (N,))
+# FIXME it should depend on global crop args instead of calculate min and max
+def center_crop_mask(x1, tol=[150., 120.]):
+    center_crop_mask = np.ones(x1.shape[1], dtype=bool)
+    for i in range(2):
+        min = x1[i].min()
+        max = x1[i].max()
+        rang = (max - min) / 2
+        med_value = min + rang
+        mask = np.abs(x1[i] - med_value) < tol[i]
+        mask = np.squeeze(np.array(mask))
+        center_crop_mask &= mask
+
+    return center_crop_mask
+
+
+def in_front_of_cam_mask(X, focal_length):
+    mask = X[2] > focal_length
+    return mask
+
+# Triangulate points
+# Input:
+#       left_img: image
+#       right_img: image
+#       P1: projection matrix 3x4 (left)
+#       P2: projection matrix 3x4 (right)
+#       N: select N points
+#       random_state: (optional) numpy.random.RandomState used to select the points
+#       matcher_name: (optional) one of triangulate.MATCHERS
+# Output:
+#       X: array of 3D points (3xN)
+def triangulate(left_img, right_img, P1, P2, N, random_state=None, matcher_name=DEFAULT_MATCHER):
+    pts_l, pts_r = get_matcher(matcher_name)(left_img, right_img)
+
+    # X's points are in camera coordinates when P1 = left_calibration_matrix, i.e. the intrinsic parameters
+    X = triangulatePoints(P1, P2, pts_l, pts_r)
+    dim = X.shape[0]
+    # X.shape -> (4xN)
+    for i in range(3):
+        # Each axis (X,Y,Z) is filtered by mask_outliers
+        mask = mask_outliers(X[i], 1000)
+        X = X[:, mask]
+        X = X.reshape((dim, -1))
+
+    x1 = np.matmul(P1, X)
+    x1 /= x1[2]
+
+    # Mask points near the center
+    c_mask = center_crop_mask(x1)
+    X = X[:, c_mask]
+
+    # Mask points that are in front of the camera
+    # FIXME we need the real focal length in camera coordinate units (not pixel!)
+    # But for now, we just chech that Z is positive
+    front_mask = in_front_of_cam_mask(X, 0.)
+    X = X[:, front_mask]
+
+    # Randomly select N points
+    replace = X.shape[1] <= N
+    if replace:
+        print(X.shape[1])
+    if random_state is None:
+        random_state = np.random
+    random_selection = random_state.choice(X.shape[1], N, replace=replace)
+    X = X[:3, random_selection]
+    return X
+
+
+# Load a stereo pair and triangulate its points
+# Input:
+#       job: (frame index, left image path, right image path)
+# Output:
+#       (frame index, 3xN array of points)
+def triangulate_frame(job):
+    frame_idx, left_img_path, right_img_path = job
+    context = get_context()
+    left_img = non_demosaic_load(left_img_path)
+    right_img = non_demosaic_load(right_img_path)
+    # Every frame has its own RNG so the output does not depend on the number of workers
+    random_state = np.random.RandomState(get_frame_seed(context['seed'], frame_idx))
+    # X.shape -> 3xN
+    X = triangulate(left_img, right_img, context['left_calibration_matrix'], context['right_calibration_matrix'],
+                    context['num_points'], random_state=random_state, matcher_name=context['matcher'])
+    return frame_idx, X
+
+
+def compute_points(sequence_dir, output_dir, num_points=DEFAULT_NUM_POINTS, seed=0, matcher_name=DEFAULT_MATCHER,
+                   workers=1, cache_dir=None, flush_every=256):
+    """Triangulates points of every stereo pair of a sequence and saves them in <output_dir>/points.npy.
+
+    Args:
+        sequence_dir (str): KITTI sequence directory, containing calib.txt, image_0 and image_1.
+        output_dir (str): output directory.
+        num_points (int): number of points randomly selected in each frame.
+        seed (int): base seed. Frame i uses seed + i.
+        matcher_name (str): stereo matcher, one of triangulate.MATCHERS.
+        workers (int): number of worker processes.
+        cache_dir (str): if supplied, points are read from or stored into a FrameCache in this directory.
+        flush_every (int): flush the output array to disk every n frames.
+
+    Returns:
+        str: path of the points file, a (frames x 3 x num_points) array.
+
+    """
+    left_image_paths, right_image_paths = list_stereo_pairs(sequence_dir)
+    points_path = os.path.join(output_dir, POINTS_FILENAME + '.npy')
+    cache = None
+    if cache_dir:
+        cache = FrameCache(cache_dir)
+        points_key = cache.key('points', [get_calibration_path(sequence_dir)] + left_image_paths + right_image_paths,
+                               seed=seed, num_points=num_points, matcher=matcher_name)
+        if cache.fetch(points_key, points_path):
+            print("Points loaded from cache")
+            return points_path
+
+    left_calibration_matrix, right_calibration_matrix = load_calibration(sequence_dir)
+    jobs = [(i, left, right) for (i, (left, right)) in enumerate(zip(left_image_paths, right_image_paths))]
+    context = {'left_calibration_matrix': left_calibration_matrix,
+               'right_calibration_matrix': right_calibration_matrix,
+               'num_points': num_points,
+               'seed': seed,
+               'matcher': matcher_name}
+    with NpyStreamWriter(os.path.join(output_dir, POINTS_FILENAME), len(jobs), np.float64,
+                         item_shape=(3, num_points), flush_every=flush_every) as points_writer:
+        for (i, X) in imap_ordered(triangulate_frame, jobs, context, workers):
+            points_writer.write(i, X)
+    if cache is not None:
+        cache.store(points_key, points_path)
+    return points_path
+
+
+def main():
+    args = get_arguments()
+    print(args)
+    output_dir = os.curdir
+    if args.output_dir:
+        output_dir = args.output_dir
+    if not os.path.isdir(output_dir):
+        raise IOError(output_dir + "is not an existing folder")
+    compute_points(args.dir, output_dir, num_points=args.num_points, seed=args.seed, matcher_name=args.matcher,
+                   workers=args.workers, cache_dir=args.cache_dir, flush_every=args.flush_every)
+
+
+if __name__ == "__main__":
+    main()
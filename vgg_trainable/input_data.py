@@ -6,7 +6,7 @@ sys.path.insert(0, parentdir)
 import collections
 from sklearn.model_selection import GroupKFold
 from six.moves import xrange
-import transformations
+from transform import se3_to_xyzquaternion
 
 Datasets = collections.namedtuple('Datasets', ['train', 'cross_validation_splits', 'test'])
 IMAGE_HEIGHT = 96
@@ -16,6 +16,9 @@ IMAGE_PIXELS = IMAGE_HEIGHT * IMAGE_WIDTH
 LABELS_SIZE = 7
 DEFAULT_MAIN_KEY = 'arr_0'
 P_FILENAME = "t.npz"
+LABELS_FILENAME = "labels.npz"
+IMAGES_FILENAME = "images.npz"
+IMAGES_NPY_FILENAME = "images.npy"
 DEFAULT_LABEL_KEY = "T"
 IMAGE_POINTS = 25
 class DataSet(object):
@@ -210,22 +213,20 @@ def _get_images_and_labels(list_of_subdir, images_dtype="uint8", labels_dtype="f
         raw_labels = numpy.load(labels_filename)[DEFAULT_MAIN_KEY]
         num_examples = raw_labels.size
         total_num_examples += num_examples
-        idxs = []
-        for i in range(num_examples):
-            single_raw_label = raw_labels[i]
-            src_idx = single_raw_label['src_idx']
-            dst_idx = single_raw_label['dst_idx']
-            rt = single_raw_label[DEFAULT_LABEL_KEY]#.reshape(LABELS_SIZE)
-            rt = numpy.asmatrix(rt)
-            #ax, ay, az = transformations.euler_from_matrix(rt[0:3,0:3])
-            q = transformations.quaternion_from_matrix(numpy.vstack((rt,[0,0,0,1.])))
-            label = numpy.array([rt[0,3],rt[1,3],rt[2,3], q[0], q[1], q[2], q[3]])
-            labels.append(label)
-            idxs.append((src_idx, dst_idx))
+        # Labels (x, y, z, qw, qx, qy, qz) are precomputed by the pre-processing scripts. Older outputs only have t.npz
+        precomputed_labels_filename = os.path.join(dir, LABELS_FILENAME)
+        dir_labels = None
+        if os.path.isfile(precomputed_labels_filename):
+            dir_labels = numpy.load(precomputed_labels_filename)[DEFAULT_MAIN_KEY]
+        if dir_labels is None or dir_labels.shape != (num_examples, LABELS_SIZE):
+            dir_labels = se3_to_xyzquaternion(raw_labels[DEFAULT_LABEL_KEY])
+        labels.append(dir_labels)
+        idxs = list(zip(raw_labels['src_idx'], raw_labels['dst_idx']))
 
         if dir in frames_idx_map:
             raise ValueError("Duplicate directory: " + dir)
         frames_idx_map[dir] = idxs
+    labels = numpy.concatenate(labels) if labels else numpy.empty((0, LABELS_SIZE))
     assert len(labels) == total_num_examples
 
     # Process images
@@ -237,8 +238,12 @@ def _get_images_and_labels(list_of_subdir, images_dtype="uint8", labels_dtype="f
     group_idx = 0
     iter = 0
     for dir in list_of_subdir:
-        images_filename = os.path.join(dir, "images.npz")
-        dataset = numpy.load(images_filename)[DEFAULT_MAIN_KEY]
+        images_npy_filename = os.path.join(dir, IMAGES_NPY_FILENAME)
+        if os.path.isfile(images_npy_filename):
+            # Uncompressed output of the preprocessing scripts, only the referenced frames are read
+            dataset = numpy.load(images_npy_filename, mmap_mode='r')
+        else:
+            dataset = numpy.load(os.path.join(dir, IMAGES_FILENAME))[DEFAULT_MAIN_KEY]
         if load_points:
             data_points = numpy.load(os.path.join(dir, "points.npy"))
         assert dataset.dtype == images_dtype
@@ -0,0 +1,46 @@
+import multiprocessing
+
+# State shared by every job, set once per worker process
+_context = {}
+
+
+def _init_worker(context):
+    _context.clear()
+    _context.update(context)
+
+
+def get_context():
+    return _context
+
+
+def imap_ordered(func, jobs, context=None, workers=1, chunksize=None):
+    """Applies a function to every job, serially or in a pool of worker processes.
+
+    Args:
+        func (callable): module level function that takes a job. It can read the context with `get_context`.
+        jobs (list): jobs to process.
+        context (dict): state shared by every job. It is sent once to each worker instead of once per job.
+        workers (int): number of worker processes. Jobs are processed in this process if it is 1 or less.
+        chunksize (int): number of jobs sent to a worker at a time.
+
+    Returns:
+        generator: results of `func`, in the same order as `jobs`.
+
+    """
+    if context is None:
+        context = {}
+    if workers <= 1:
+        _init_worker(context)
+        for job in jobs:
+            yield func(job)
+        return
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (workers * 8))
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(context,))
+    try:
+        for result in pool.imap(func, jobs, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()